@@ -1,21 +1,44 @@
 """Gmail polling service for Indeed/Jimoty job application notifications."""
 import imaplib
 import email
+import mmap
 from email.header import decode_header
-from email.utils import parseaddr
+from email.iterators import typed_subpart_iterator
+from email.parser import BytesHeaderParser
+from email.utils import parseaddr, parsedate_to_datetime
+from html import unescape as html_unescape
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
 import os
+import queue
+import random
+import signal
 import socket
 import sys
+import threading
 import time
 import json
+import logging
 import re
+import select
+import ssl
+from collections.abc import MutableSet
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Set, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 import requests
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta, timezone
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup  # 実行時は make_soup() の中で遅延 import する
+
+try:
+    import orjson  # C 実装の JSON（processed_ids の読み書き用）。未導入なら標準 json を使う。
+except ImportError:  # pragma: no cover - 実行環境による分岐
+    orjson = None
+
 # gmail_oauth は「python src/main.py」（Procfile・src/ がトップに乗る）でも
 # 「from src.main import ...」（テスト・リポジトリルートが乗る）でも import できるよう両対応。
 try:
@@ -54,6 +77,14 @@ SLACK_DM_WEBHOOK_URL = os.getenv("SLACK_DM_WEBHOOK_URL")
 # --- Processed IDs file for duplicate prevention ---
 PROCESSED_IDS_FILE = os.getenv("PROCESSED_IDS_FILE", os.path.join(LOG_DIR, "processed_ids.json"))
 MAX_PROCESSED_IDS = 5000
+# 新規IDは追記専用ジャーナル（PROCESSED_IDS_FILE の名前に .journal を足したもの）に1行ずつ追記し、
+# この件数たまったらスナップショット（PROCESSED_IDS_FILE）へ畳み込んでジャーナルを消す。
+PROCESSED_IDS_JOURNAL_COMPACT_THRESHOLD = int(os.getenv("PROCESSED_IDS_JOURNAL_COMPACT_THRESHOLD", "500"))
+# 件数が少ない環境でもジャーナルが育ち続けず保持期間の掃除も走るよう、最後のスナップショットから
+# この秒数が経ったら件数に関係なく畳み込む（既定1日）。
+PROCESSED_IDS_JOURNAL_COMPACT_SECONDS = int(os.getenv("PROCESSED_IDS_JOURNAL_COMPACT_SECONDS", "86400"))
+_journal_entry_count = 0  # 現在のジャーナルの行数（最後のスナップショット以降の追記件数）
+_last_snapshot_at = 0.0  # 最後にスナップショットを書いた（または読み込んだ）時刻
 
 
 # --- Polling Interval ---
@@ -63,12 +94,28 @@ MAX_BACKOFF_SECONDS = int(os.getenv("MAX_BACKOFF_SECONDS", "900"))  # 最大15
 # --- Search window for emails (days) ---
 SEARCH_DAYS = int(os.getenv("SEARCH_DAYS", "1"))  # デフォルト1日間（Gmail API制限対策）
 
+# --- Processed IDs retention (days) ---
+# SEARCH SINCE は日付単位なので検索窓は最大 SEARCH_DAYS+1 日。それより前に処理済みになったIDの
+# メールは二度と検索に掛からないため、保持期間を過ぎたIDはスナップショット保存時に捨てる。
+PROCESSED_IDS_RETENTION_DAYS = max(int(os.getenv("PROCESSED_IDS_RETENTION_DAYS", "14")), SEARCH_DAYS + 2)
+
+# --- Optional server-side pre-filter (Gmail X-GM-RAW) ---
+# 設定すると UID SEARCH に Gmail の検索クエリ（例: 'subject:(応募 OR ジモティー)'）を加えて候補を絞る。
+# 既定は未設定（SINCE のみ）。件名で絞ると「件名不一致の Indeed メール」検知（未分類アラート）が
+# 効かなくなるため、取りこぼしより検索コストを優先したい場合だけ明示的に有効にする。
+IMAP_SEARCH_GM_RAW = os.getenv("IMAP_SEARCH_GM_RAW", "").strip()
+
 # --- Batch limit per cycle (QUOTA ERROR対策) ---
 MAX_EMAILS_PER_CYCLE = int(os.getenv("MAX_EMAILS_PER_CYCLE", "10"))  # 1サイクルで処理する最大メール数
 
 # --- IMAP robustness ---
 IMAP_TIMEOUT_SECONDS = int(os.getenv("IMAP_TIMEOUT_SECONDS", "30"))
 IMAP_RETRY_BACKOFFS = [5, 10, 20]  # 接続失敗時のexponential backoff（秒）。長さがリトライ回数。
+# 正常サイクル後は固定間隔スリープの代わりに IMAP IDLE（RFC 2177）で新着を待つ。
+# IDLE 非対応サーバや IDLE 失敗時は POLL_INTERVAL_SECONDS のポーリングに戻る。
+IMAP_IDLE_ENABLED = os.getenv("IMAP_IDLE_ENABLED", "1") != "0"
+# RFC 2177 はサーバが30分無通信で切断しうるため、29分以内に DONE → IDLE で張り直す。
+IMAP_IDLE_TIMEOUT_SECONDS = int(os.getenv("IMAP_IDLE_TIMEOUT_SECONDS", str(29 * 60)))
 
 # --- Error notification deduplication ---
 ERROR_NOTIFICATION_DEDUP_SECONDS = int(os.getenv("ERROR_NOTIFICATION_DEDUP_SECONDS", "600"))  # 同一エラーの再通知抑制（10分）
@@ -76,6 +123,8 @@ ERROR_NOTIFICATION_DEDUP_SECONDS = int(os.getenv("ERROR_NOTIFICATION_DEDUP_SECON
 # すぐには直らないため、10分おきに通知を垂れ流さず長めの間隔に集約する。
 AUTH_ERROR_NOTIFICATION_DEDUP_SECONDS = int(os.getenv("AUTH_ERROR_NOTIFICATION_DEDUP_SECONDS", "21600"))
 _last_error_notification_ts: dict = {}  # dedup_key -> last unix timestamp
+# Slack と LINE の通知スレッドが同時に notify_error_to_slack を呼ぶため、掃除・重複判定・記録をまとめて守る
+_error_notification_lock = threading.Lock()
 # --- Unclassified mail normal-channel dedup ---
 # 未分類Indeedメール（determine_source が None を返したもの）について、
 # 通常チャネル（Slack/LINE 応募通知）への送信を「1メール=1回限り」に制限する。
@@ -83,8 +132,21 @@ _last_error_notification_ts: dict = {}  # dedup_key -> last unix timestamp
 # 従来どおり10分間隔で送り続けるが、通常チャネルへの再送はスパムになるため抑制する。
 _unclassified_normal_notified: Set[str] = set()  # unique_id -> 通常チャネル送信済み
 
+# --- Notification retry (exponential backoff + jitter) ---
+# 待ち時間 = min(cap, base * 2**attempt) * (1 + U(0, jitter))。Retry-After があればそちらを優先する。
+# 再送するのは一時障害（429 / 5xx / 例外）だけ。他の 4xx は再送しても結果が変わらない。
+NOTIFY_RETRY_BASE_SECONDS = 1.0
+NOTIFY_RETRY_CAP_SECONDS = 30.0
+NOTIFY_RETRY_JITTER = 0.5
+RETRYABLE_HTTP_STATUSES = frozenset({429, 500, 502, 503, 504})
+
 # --- Shared HTTP session (M-9: connection reuse across requests) ---
+# Slack / LINE / 短縮URL の各ホストへの keep-alive 接続をプールして TLS ハンドシェイクを使い回す。
+# リトライは notify_*_with_retry 側で制御するため、アダプタには Retry を付けない（二重リトライ防止）。
+HTTP_CONNECT_TIMEOUT_SECONDS = 3  # TCP/TLS 接続確立のタイムアウト（読み取りは呼び出しごとに指定）
 _http_session = requests.Session()
+_http_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+_http_session.mount("https://", _http_adapter)
 
 
 def is_auth_failure(error: object) -> bool:
@@ -156,16 +218,69 @@ INDEED_NON_APPLICATION_PATTERNS = [
     "配信を停止",
     "メール配信設定",
 ]
+# 上の各フレーズを1本の正規表現にまとめ、件名を1回の走査で判定する
+_INDEED_NON_APPLICATION_RE = re.compile("|".join(map(re.escape, INDEED_NON_APPLICATION_PATTERNS)))
 
 
 # --- Logging ---
+# recruit.log はプロセス中ずっと開いたままにし（1行ごとの open/close をしない）、
+# LOG_MAX_BYTES でローテーションして LOG_DIR を食い潰さないようにする。
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+
+def _setup_logger() -> Tuple[logging.Logger, Optional[QueueListener]]:
+    """Configure the "recruit" logger: rotating recruit.log in LOG_DIR plus stdout, UTC timestamps.
+
+    呼び出し元スレッド（IMAP ループ・通知スレッド）はキューに積むだけにして、ファイル/stdout への
+    書き込みは QueueListener のバックグラウンドスレッドが行う。リスナーはここでは起動せず、
+    最初の log() で起動する（import しただけではスレッドも atexit も増やさない）。
+    """
+    logger = logging.getLogger("recruit")
+    if logger.handlers:
+        return logger, None
+    formatter = logging.Formatter("%(asctime)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    formatter.converter = time.gmtime  # 従来どおり UTC で出す
+    file_handler = RotatingFileHandler(
+        os.path.join(LOG_DIR, "recruit.log"),
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+        encoding="utf-8",
+        delay=True,  # 最初のログ出力まで開かない（import 時点で LOG_DIR が無くても落ちない）
+    )
+    handlers = (file_handler, logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger, listener
+
+
+_logger, _log_listener = _setup_logger()
+_log_listener_started = False
+_log_listener_lock = threading.Lock()
+
+
+def _start_log_listener() -> None:
+    """Start the QueueListener thread once (called from the first log())."""
+    global _log_listener_started
+    with _log_listener_lock:
+        if _log_listener_started:
+            return
+        if _log_listener is not None:
+            _log_listener.start()
+            atexit.register(_log_listener.stop)  # 終了時にキューに残った行を書き切る
+        _log_listener_started = True
+
+
 def log(msg: str) -> None:
     """Log message to file and stdout."""
-    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-    line = f"{ts} {msg}"
-    with open(os.path.join(LOG_DIR, "recruit.log"), "a", encoding="utf-8") as f:
-        f.write(line + "\n")
-    print(line, flush=True)
+    if not _log_listener_started:
+        _start_log_listener()
+    _logger.info(msg)
 
 
 def ensure_processed_ids_dir() -> bool:
@@ -206,59 +321,243 @@ def migrate_old_id_format(ids: Set[str]) -> Set[str]:
     return migrated
 
 
-def load_processed_ids() -> Tuple[Set[str], bool]:
-    """Load processed message IDs from file.
+class ProcessedIds(MutableSet):
+    """処理済みIDの集合。外からは従来どおり "gm:123" 等の文字列の集合として振る舞う。
+
+    大半を占める gm:<X-GM-MSGID> と uid:<UID> は数値部分を int にして prefix ごとに持つ
+    （文字列オブジェクトを作らず、ハッシュも int の即値で済む）。mid:<Message-ID> や
+    unclf: など数値でないIDは文字列のまま持つ。各IDには追加時刻（unix 秒）を添えて、
+    保持期間を過ぎたIDを evict_older_than() で捨てられるようにする。
+    """
+
+    _INT_PREFIXES = ("gm:", "uid:")
+
+    def __init__(self, items=()) -> None:
+        self._ints: Dict[str, Dict[int, int]] = {prefix: {} for prefix in self._INT_PREFIXES}
+        self._strs: Dict[str, int] = {}
+        for item in items:
+            self.add(item)
+
+    def _split(self, item: str) -> Tuple[Optional[str], object]:
+        """(prefix, int) に分解する。int で持てないIDは (None, 元の文字列)。"""
+        for prefix in self._INT_PREFIXES:
+            if item.startswith(prefix):
+                digits = item[len(prefix):]
+                # 先頭ゼロ付きは int にすると元の文字列に戻せないので文字列のまま扱う
+                if digits.isascii() and digits.isdigit() and (digits[0] != "0" or digits == "0"):
+                    return prefix, int(digits)
+                break
+        return None, item
+
+    def _bucket(self, prefix: Optional[str]) -> dict:
+        return self._strs if prefix is None else self._ints[prefix]
+
+    def __contains__(self, item: object) -> bool:
+        if not isinstance(item, str):
+            return False
+        prefix, key = self._split(item)
+        return key in self._bucket(prefix)
+
+    def __iter__(self):
+        yield from self._strs
+        for prefix, keys in self._ints.items():
+            for key in keys:
+                yield f"{prefix}{key}"
+
+    def __len__(self) -> int:
+        return len(self._strs) + sum(len(keys) for keys in self._ints.values())
+
+    def add(self, item: str, added_at: Optional[int] = None) -> None:
+        """Add item, stamped with added_at (default: now). An existing item keeps its first stamp."""
+        prefix, key = self._split(item)
+        self._bucket(prefix).setdefault(key, int(time.time()) if added_at is None else int(added_at))
+
+    def discard(self, item: str) -> None:
+        if not isinstance(item, str):
+            return
+        prefix, key = self._split(item)
+        self._bucket(prefix).pop(key, None)
+
+    def added_at(self, item: str) -> Optional[int]:
+        """Return the unix time item was added, or None if it is not present."""
+        prefix, key = self._split(item)
+        return self._bucket(prefix).get(key)
+
+    def evict_older_than(self, cutoff: int) -> int:
+        """Drop every item added before cutoff (unix time). Returns the number dropped."""
+        evicted = 0
+        for bucket in (self._strs, *self._ints.values()):
+            stale = [key for key, ts in bucket.items() if ts < cutoff]
+            for key in stale:
+                del bucket[key]
+            evicted += len(stale)
+        return evicted
+
+    def __repr__(self) -> str:
+        return f"ProcessedIds({sorted(self)!r})"
+
+
+def _json_loads(raw):
+    """Decode a JSON bytes-like object with orjson when available, else the stdlib json module."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(bytes(raw))
+
+
+def _json_dumps(obj) -> bytes:
+    """Encode obj as JSON bytes with orjson when available, else the stdlib json module."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # orjson と同じく区切りの空白を入れず、非 ASCII も \uXXXX にせず UTF-8 のまま書く
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def get_processed_ids_journal_path() -> Path:
+    """Return the append-only journal path that accompanies PROCESSED_IDS_FILE."""
+    # 拡張子の置き換えだと recruit.json → recruit.log のようにアプリのログと衝突しうるので、名前に足す
+    path = Path(PROCESSED_IDS_FILE)
+    return path.with_name(path.name + ".journal")
+
+
+def _read_processed_ids_snapshot(path: str) -> list:
+    """スナップショットを mmap 経由でデコードする（read() によるバッファコピーを省く）。"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # 0 バイトのファイルは mmap できない。保存は tmp+replace で原子的に行うため、
+            # 空ファイルは従来どおり「破損」として扱う。
+            raise json.JSONDecodeError("processed IDs file is empty", "", 0)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                return _json_loads(view)
+
+
+def _read_processed_ids_journal(journal_path: Path) -> List[Tuple[str, Optional[int]]]:
+    """ジャーナルの各行（"ID\t追加時刻"）を (ID, 追加時刻) のリストで返す。存在しなければ空リスト。
+
+    追加時刻の無い旧形式の行（1行=1ID）は時刻 None として返す。
+    """
+    if not journal_path.exists():
+        return []
+    entries = []
+    with open(journal_path, "r", encoding="utf-8") as f:
+        # ファイル全体を1つの文字列に読み込まず、行単位でストリーム処理する
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            item, sep, ts = line.rpartition("\t")
+            if sep and ts.isdigit():
+                entries.append((item, int(ts)))
+            else:
+                entries.append((line, None))
+    return entries
+
+
+def load_processed_ids() -> Tuple[ProcessedIds, bool]:
+    """Load processed message IDs from the snapshot file and replay the journal.
 
     Returns:
         Tuple of (processed_ids set, success flag).
         If file exists but can't be read, returns (empty set, False)
         to prevent mass re-processing.
     """
-    if os.path.exists(PROCESSED_IDS_FILE):
-        try:
-            with open(PROCESSED_IDS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            log(f"Loaded {len(data)} processed IDs from {PROCESSED_IDS_FILE}")
-            # Migrate old format IDs to new format
-            original_set = set(data)
-            migrated = migrate_old_id_format(original_set)
-            # Save immediately if migration occurred to prevent re-migration on crash
-            if migrated != original_set:
-                save_processed_ids(migrated)
-            return migrated, True
-        except (json.JSONDecodeError, IOError) as e:
-            log(f"ERROR: Failed to load processed IDs (file exists but corrupted): {e}")
-            notify_error_to_slack(f"CRITICAL: Failed to load processed IDs - file corrupted: {e}")
-            # Return False to prevent mass re-processing of all emails
-            return set(), False
-    else:
+    global _journal_entry_count, _last_snapshot_at
+    _last_snapshot_at = time.time()
+    journal_path = get_processed_ids_journal_path()
+    if not os.path.exists(PROCESSED_IDS_FILE) and not journal_path.exists():
         log(f"Processed IDs file does not exist: {PROCESSED_IDS_FILE} (first run)")
-        return set(), True
+        return ProcessedIds(), True
+    try:
+        now = int(time.time())
+        stamps: Dict[str, int] = {}  # ID -> 追加時刻
+        if os.path.exists(PROCESSED_IDS_FILE):
+            _last_snapshot_at = os.path.getmtime(PROCESSED_IDS_FILE)
+            data = _read_processed_ids_snapshot(PROCESSED_IDS_FILE)
+            # 旧形式（追加時刻なしのIDリスト）は読み込み時刻を追加時刻とみなす
+            stamps.update(data.items() if isinstance(data, dict) else ((item, now) for item in data))
+            log(f"Loaded {len(data)} processed IDs from {PROCESSED_IDS_FILE}")
+        journal_entries = _read_processed_ids_journal(journal_path)
+        if journal_entries:
+            log(f"Replayed {len(journal_entries)} processed IDs from journal {journal_path}")
+        for item, ts in journal_entries:
+            stamps.setdefault(item, now if ts is None else ts)
+        _journal_entry_count = len(journal_entries)
+        # Migrate old format IDs to new format
+        original_set = set(stamps)
+        migrated = migrate_old_id_format(original_set)
+        processed_ids = ProcessedIds()
+        for item in migrated:
+            # 移行で "gm:" が付いたIDは元の数字だけのIDの時刻を引き継ぐ
+            processed_ids.add(item, added_at=stamps.get(item, stamps.get(item[len("gm:"):], now)))
+        evicted = processed_ids.evict_older_than(now - PROCESSED_IDS_RETENTION_DAYS * 86400)
+        if evicted:
+            log(f"Evicted {evicted} processed IDs older than {PROCESSED_IDS_RETENTION_DAYS} days")
+        # Save immediately if migration occurred to prevent re-migration on crash
+        if migrated != original_set:
+            save_processed_ids(processed_ids)
+        return processed_ids, True
+    except (json.JSONDecodeError, UnicodeDecodeError, IOError) as e:
+        # orjson.JSONDecodeError は json.JSONDecodeError のサブクラス
+        log(f"ERROR: Failed to load processed IDs (file exists but corrupted): {e}")
+        notify_error_to_slack(f"CRITICAL: Failed to load processed IDs - file corrupted: {e}")
+        # Return False to prevent mass re-processing of all emails
+        return ProcessedIds(), False
+
+
+def _processed_id_added_at(processed_ids: Set[str], item: str, default: int) -> int:
+    """item の追加時刻。ProcessedIds 以外の集合（時刻を持たない）では default を返す。"""
+    if isinstance(processed_ids, ProcessedIds):
+        added_at = processed_ids.added_at(item)
+        if added_at is not None:
+            return added_at
+    return default
 
 
 def save_processed_ids(processed_ids: Set[str]) -> bool:
     """Save processed message IDs to file atomically. Returns True if successful.
 
+    The snapshot is a JSON object mapping each ID to the unix time it was
+    added; IDs older than PROCESSED_IDS_RETENTION_DAYS are evicted here.
+
     Uses tempfile + os.replace() for atomic write to prevent JSON corruption on crash.
     Note: uid: entries are session-only cache and are NOT persisted to disk.
     Only gm: and mid: entries (which provide deduplication correctness) are saved.
     This prevents unbounded file growth from uid: cache accumulation.
+
+    The snapshot supersedes the append-only journal, so the journal is removed
+    once the snapshot has been replaced.
     """
+    global _journal_entry_count, _last_snapshot_at
     if not ensure_processed_ids_dir():
         return False
     try:
+        now = int(time.time())
+        if isinstance(processed_ids, ProcessedIds):
+            # 保持期間を過ぎたIDはメモリからも捨てる（uid: キャッシュも同じ期限で消える）
+            evicted = processed_ids.evict_older_than(now - PROCESSED_IDS_RETENTION_DAYS * 86400)
+            if evicted:
+                log(f"Evicted {evicted} processed IDs older than {PROCESSED_IDS_RETENTION_DAYS} days")
         # Exclude uid: entries - they are session-only cache, gm:/mid: entries handle dedup
-        persistent_ids = [item for item in processed_ids if not item.startswith("uid:")]
-        # Trim to MAX_PROCESSED_IDS to prevent unbounded growth
+        persistent_ids = {
+            item: _processed_id_added_at(processed_ids, item, now)
+            for item in processed_ids if not item.startswith("uid:")
+        }
+        # Trim to MAX_PROCESSED_IDS (keeping the most recently added) to prevent unbounded growth
         if len(persistent_ids) > MAX_PROCESSED_IDS:
-            persistent_ids.sort()
-            persistent_ids = persistent_ids[-MAX_PROCESSED_IDS:]
+            newest = sorted(persistent_ids.items(), key=lambda kv: kv[1])[-MAX_PROCESSED_IDS:]
+            persistent_ids = dict(newest)
         # Atomic write: write to temp file then replace to prevent partial writes on crash
         target_path = Path(PROCESSED_IDS_FILE)
         tmp_path = target_path.with_suffix(".tmp")
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(persistent_ids, f)
+        with open(tmp_path, "wb") as f:
+            f.write(_json_dumps(persistent_ids))
         tmp_path.replace(target_path)
+        # スナップショットに全件入ったのでジャーナルは不要（消す前に落ちても再生で同じ集合になる）
+        get_processed_ids_journal_path().unlink(missing_ok=True)
+        _journal_entry_count = 0
+        _last_snapshot_at = time.time()
         log(f"Saved {len(persistent_ids)} processed IDs to {PROCESSED_IDS_FILE} (excluded {len(processed_ids) - len(persistent_ids)} uid: cache entries)")
         return True
     except IOError as e:
@@ -267,6 +566,41 @@ def save_processed_ids(processed_ids: Set[str]) -> bool:
         return False
 
 
+def append_processed_ids(processed_ids: Set[str], new_ids: list) -> bool:
+    """新しく処理済みになったIDだけをジャーナルへ追記する。Returns True if successful.
+
+    save_processed_ids() は集合全体を書き直すため1通ごとに呼ぶと O(N) の書き込みになる。
+    こちらは新規IDの行を追記して fsync するだけ（O(1)）。ジャーナルが
+    PROCESSED_IDS_JOURNAL_COMPACT_THRESHOLD 行に達するか、最後のスナップショットから
+    PROCESSED_IDS_JOURNAL_COMPACT_SECONDS 経ったらスナップショットへ畳み込む。
+    new_ids は呼び出し前に processed_ids へ追加済みであること。uid: は永続化しない。
+    """
+    global _journal_entry_count
+    persistent_ids = [item for item in new_ids if not item.startswith("uid:")]
+    if not persistent_ids:
+        return True
+    if (_journal_entry_count + len(persistent_ids) >= PROCESSED_IDS_JOURNAL_COMPACT_THRESHOLD
+            or time.time() - _last_snapshot_at >= PROCESSED_IDS_JOURNAL_COMPACT_SECONDS):
+        return save_processed_ids(processed_ids)
+    if not ensure_processed_ids_dir():
+        return False
+    journal_path = get_processed_ids_journal_path()
+    try:
+        now = int(time.time())
+        with open(journal_path, "a", encoding="utf-8") as f:
+            f.write("".join(
+                f"{item}\t{_processed_id_added_at(processed_ids, item, now)}\n" for item in persistent_ids
+            ))
+            f.flush()
+            os.fsync(f.fileno())
+        _journal_entry_count += len(persistent_ids)
+        return True
+    except IOError as e:
+        log(f"ERROR: Failed to append processed IDs to journal: {e}")
+        notify_error_to_slack(f"Failed to append processed IDs to journal: {e}")
+        return False
+
+
 def notify_error_to_slack(message: str, dedup_key: Optional[str] = None,
                           dedup_seconds: Optional[int] = None) -> None:
     """重大なエラーを Slack Webhook に通知する。
@@ -279,51 +613,49 @@ def notify_error_to_slack(message: str, dedup_key: Optional[str] = None,
         dedup_seconds: 重複抑止の窓（秒）。省略時は ERROR_NOTIFICATION_DEDUP_SECONDS。
             認証失効など長く続く障害は長めの窓を指定して通知フラッドを防ぐ。
     """
-    # サイズ上限（古いエントリを自動削除）
-    if len(_last_error_notification_ts) > 500:
-        cutoff = time.time() - (dedup_seconds if dedup_seconds is not None else ERROR_NOTIFICATION_DEDUP_SECONDS)
-        expired = [k for k, v in _last_error_notification_ts.items() if v < cutoff]
-        for k in expired:
-            del _last_error_notification_ts[k]
-
     key = dedup_key if dedup_key is not None else message
     window = dedup_seconds if dedup_seconds is not None else ERROR_NOTIFICATION_DEDUP_SECONDS
-    now_ts = time.time()
-    last_ts = _last_error_notification_ts.get(key, 0.0)
-    if now_ts - last_ts < window:
+    with _error_notification_lock:
+        # サイズ上限（古いエントリを自動削除）
+        if len(_last_error_notification_ts) > 500:
+            cutoff = time.time() - window
+            expired = [k for k, v in _last_error_notification_ts.items() if v < cutoff]
+            for k in expired:
+                del _last_error_notification_ts[k]
+
+        now_ts = time.time()
+        last_ts = _last_error_notification_ts.get(key, 0.0)
+        duplicate = now_ts - last_ts < window
+        if not duplicate:
+            _last_error_notification_ts[key] = now_ts
+    if duplicate:
         log(f"Skipping duplicate error notification within {window}s window: key={key[:80]}")
         return
-    _last_error_notification_ts[key] = now_ts
 
     webhook_url = SLACK_ERROR_WEBHOOK_URL or SLACK_WEBHOOK_URL_PROD
     if not webhook_url:
         log("ERROR: No Slack webhook URL configured; cannot notify error to Slack")
         return
     text = f"🚨 Indeed応募通知エラー発生\n{message}"
-    try:
-        resp = _http_session.post(
-            webhook_url,
-            json={"text": text},
-            timeout=5,
-        )
-        if resp.status_code >= 400:
-            log(f"ERROR: failed to send error notification to Slack (status={resp.status_code}, body={resp.text})")
-    except Exception as e:
-        # 通知時のエラーでさらに例外を投げるとループするのでログのみ
-        log(f"ERROR: exception while sending error notification to Slack: {e}")
+    # 送信失敗はログのみ（ここから例外を投げたりエラー通知を重ねたりするとループする）。
+    # 通知スレッドや IMAP サイクルから呼ばれるため、バックオフ付きの再送はせず各宛先1回だけ送る。
+    post_with_retry(
+        webhook_url,
+        "error notification to Slack",
+        max_retries=1,
+        json={"text": text},
+        timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 5),
+    )
 
     # DM にも同じメッセージを送信
     if SLACK_DM_WEBHOOK_URL:
-        try:
-            dm_resp = _http_session.post(
-                SLACK_DM_WEBHOOK_URL,
-                json={"text": text},
-                timeout=5,
-            )
-            if dm_resp.status_code >= 400:
-                log(f"ERROR: failed to send error DM to Slack (status={dm_resp.status_code})")
-        except Exception as e:
-            log(f"ERROR: exception while sending error DM to Slack: {e}")
+        post_with_retry(
+            SLACK_DM_WEBHOOK_URL,
+            "error DM to Slack",
+            max_retries=1,
+            json={"text": text},
+            timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 5),
+        )
 
 
 # --- MODE management ---
@@ -358,32 +690,64 @@ def decode_header_value(value: Optional[str]) -> str:
     """Decode email header value."""
     if not value:
         return ""
-    parts = decode_header(value)
+    # エンコードされた語（=?charset?...?=）を含まない str はそのままの値（大半のヘッダはここで返る）
+    if isinstance(value, str):
+        return value if "=?" not in value else _decode_encoded_header(value)
+    return _join_decoded_parts(decode_header(value))  # compat32 の Header（生の 8bit ヘッダ）はキャッシュしない
+
+
+@lru_cache(maxsize=1024)
+def _decode_encoded_header(value: str) -> str:
+    """RFC 2047 エンコードされたヘッダ文字列をデコードする。
+
+    同じメールの件名・From は分類（mail_needs_body）と処理（process_parsed_mail）で、
+    再処理待ちのメールは毎サイクル、同じ値で繰り返しデコードされるのでキャッシュする。
+    """
+    return _join_decoded_parts(decode_header(value))
+
+
+def _join_decoded_parts(parts: list) -> str:
+    """Join decode_header() output into one str (bytes parts decoded with their charset)."""
     return "".join(
-        text.decode(enc or "utf-8", errors="replace") if isinstance(text, bytes) else text
+        _decode_header_bytes(text, enc) if isinstance(text, bytes) else text
         for text, enc in parts
     )
 
 
+def _decode_header_bytes(text: bytes, charset: Optional[str]) -> str:
+    """ヘッダの1パートを charset でデコードする。
+
+    charset 無し・UTF-8 はコーデック検索なしで直接デコードする。compat32 が生の 8bit ヘッダに
+    付ける "unknown-8bit" のような Python が知らない charset は、実態の多い UTF-8 として読む。
+    """
+    if charset is None or charset.lower() in ("utf-8", "utf8"):
+        return text.decode("utf-8", errors="replace")
+    try:
+        return text.decode(charset, errors="replace")
+    except LookupError:
+        return text.decode("utf-8", errors="replace")
+
+
 def extract_name(from_header: Optional[str]) -> str:
     """Extract applicant name from From header."""
     if not from_header:
         return "Unknown"
-    try:
-        return from_header.split("<")[0].replace('"', "").strip()
-    except (IndexError, AttributeError):
-        return from_header
+    # "<" より前（表示名）だけを取り出す。partition は区切り以降のリストを作らない
+    return from_header.partition("<")[0].replace('"', "").strip()
 
 
 def extract_html(msg: email.message.Message) -> str:
     """Extract HTML content from email message."""
     if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == "text/html":
-                charset = part.get_content_charset() or "utf-8"
-                payload = part.get_payload(decode=True)
-                if payload:
-                    return payload.decode(charset, errors="replace")
+        # text/html の葉パートだけを順に見る（multipart の入れ物や画像等はここで除かれる）
+        for part in typed_subpart_iterator(msg, "text", "html"):
+            # 添付ファイル（.html 添付）は本文ではないので見ない
+            if part.get_content_disposition() == "attachment":
+                continue
+            charset = part.get_content_charset() or "utf-8"
+            payload = part.get_payload(decode=True)
+            if payload:
+                return payload.decode(charset, errors="replace")
     elif msg.get_content_type() == "text/html":
         charset = msg.get_content_charset() or "utf-8"
         payload = msg.get_payload(decode=True)
@@ -392,19 +756,85 @@ def extract_html(msg: email.message.Message) -> str:
     return ""
 
 
+# 応募者名・職種の抽出（make_soup）で使う HTML パーサ。C 実装の lxml を優先し、未導入の環境では
+# 標準の html.parser にフォールバックする（extract_indeed_url は正規表現で走査するので使わない）。
+_SOUP_PARSER = "lxml"
+
+
+def make_soup(html: str) -> "BeautifulSoup":
+    """Parse html with lxml when available, falling back to the pure-Python html.parser.
+
+    bs4 はジモティーのみのサイクルでは不要なので、ここで初めて import する。
+    """
+    from bs4 import BeautifulSoup, FeatureNotFound
+
+    global _SOUP_PARSER
+    try:
+        return BeautifulSoup(html, _SOUP_PARSER)
+    except FeatureNotFound:
+        log("WARN: lxml is not installed; falling back to html.parser")
+        _SOUP_PARSER = "html.parser"
+        return BeautifulSoup(html, _SOUP_PARSER)
+
+
+INDEED_APPLY_BUTTON_TEXT = "応募内容を確認する"
+# <a ... href=...> の開始タグ。href の値は "..." / '...' / 引用符なしのいずれか（グループ 1〜3）
+_ANCHOR_HREF_PATTERN = r"""<a\b[^>]*?\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>"']+))"""
+_RE_ANCHOR_HREF = re.compile(_ANCHOR_HREF_PATTERN, re.IGNORECASE)
+# <a ... href="...">本文</a> 全体（本文はグループ 4）。extract_indeed_url はこれで HTML を一度なめるだけで済ませる
+_RE_ANCHOR = re.compile(_ANCHOR_HREF_PATTERN + r"""[^>]*>(.*?)</a\s*>""", re.IGNORECASE | re.DOTALL)
+_RE_TAG = re.compile(r"<[^>]+>")
+
+
+def _anchor_href(match: "re.Match[str]") -> str:
+    """Return the href captured by _RE_ANCHOR_HREF / _RE_ANCHOR with character references unescaped."""
+    return html_unescape(next(g for g in match.group(1, 2, 3) if g is not None))
+
+
+def _anchor_text(body: str) -> str:
+    """<a> の本文から内側のタグを除き文字参照を戻す（BeautifulSoup の get_text() 相当）。
+
+    「応募内容を<br>確認する」や &#24540;募… のようにタグ・文字参照で分かれたボタン文言も一致させる。
+    """
+    if "<" in body:
+        body = _RE_TAG.sub("", body)
+    return html_unescape(body) if "&" in body else body
+
+
+def _find_indeed_button_href(html: str) -> Optional[str]:
+    """「応募内容を確認する」ボタンの href を、全 <a> を走査せずに探す高速経路。
+
+    最初のボタン文言の直前にある <a> を見て、その <a> がまだ閉じておらず href を持つ場合だけ
+    その URL を返す。ボタン文言が <a> の外にある等、判断できない場合は None（呼び出し側で全 <a> を走査）。
+    """
+    idx = html.find(INDEED_APPLY_BUTTON_TEXT)
+    if idx == -1:
+        return None
+    start = max(html.rfind("<a", 0, idx), html.rfind("<A", 0, idx))
+    if start == -1 or "</a" in html[start:idx].lower():
+        return None
+    match = _RE_ANCHOR_HREF.match(html, start, idx)
+    if not match:
+        return None
+    return _anchor_href(match)
+
+
 def extract_indeed_url(html: str) -> str:
     """Extract application URL from Indeed email HTML."""
     if not html:
         return ""
-    soup = BeautifulSoup(html, "html.parser")
-    for a in soup.find_all("a"):
-        if "応募内容を確認する" in (a.get_text() or ""):
-            return a.get("href") or ""
-    for a in soup.find_all("a"):
-        href = a.get("href") or ""
-        if "indeed" in href:
+    href = _find_indeed_button_href(html)
+    if href:
+        return href
+    # 1回の走査で「応募内容を確認する」ボタンを探しつつ、最初の indeed リンクを控えておく
+    fallback = ""
+    for match in _RE_ANCHOR.finditer(html):
+        href = _anchor_href(match)
+        if INDEED_APPLY_BUTTON_TEXT in _anchor_text(match.group(4)):
             return href
-    return ""
+        if not fallback and "indeed" in href:
+            fallback = href
+    return fallback
 
 
 def extract_applicant_name_from_html(html: str) -> Optional[str]:
@@ -420,7 +850,7 @@ def extract_applicant_name_from_html(html: str) -> Optional[str]:
     """
     if not html:
         return None
-    soup = BeautifulSoup(html, "html.parser")
+    soup = make_soup(html)
     text = soup.get_text(separator="\n")
 
     # パターン1: 「○○さんからの応募」「○○さんが応募しました」
@@ -465,7 +895,7 @@ def extract_job_title_from_html(html: str) -> Optional[str]:
     """IndeedメールHTML本文から求人名を抽出する。"""
     if not html:
         return None
-    soup = BeautifulSoup(html, "html.parser")
+    soup = make_soup(html)
     text = soup.get_text(separator="\n")
 
     for pattern in [
@@ -486,7 +916,7 @@ def _shorten_via_tinyurl(encoded_url: str) -> Optional[str]:
     """Try to shorten a URL via TinyURL. Returns shortened URL or None."""
     try:
         api = "https://tinyurl.com/api-create.php?url=" + encoded_url
-        resp = _http_session.get(api, timeout=8)
+        resp = _http_session.get(api, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 8))
         if resp.status_code == 200 and resp.text.strip().startswith("http"):
             return resp.text.strip()
         log(f"WARN: TinyURL shorten returned status={resp.status_code}")
@@ -499,7 +929,7 @@ def _shorten_via_isgd(encoded_url: str) -> Optional[str]:
     """Try to shorten a URL via is.gd. Returns shortened URL or None."""
     try:
         api = "https://is.gd/create.php?format=simple&url=" + encoded_url
-        resp = _http_session.get(api, timeout=5)
+        resp = _http_session.get(api, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 5))
         if resp.status_code == 200 and resp.text.strip().startswith("http"):
             return resp.text.strip()
         log(f"WARN: is.gd shorten returned status={resp.status_code} body={resp.text[:80]}")
@@ -531,34 +961,92 @@ def shorten_url(url: str) -> str:
 
 
 # --- Notification Functions ---
+def retry_after_seconds(resp: Optional[requests.Response]) -> Optional[float]:
+    """Retry-After ヘッダ（秒数 or HTTP-date）を待ち秒数にして返す。無い・解釈できなければ None。"""
+    value = resp.headers.get("Retry-After") if resp is not None else None
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def notify_retry_delay(attempt: int, resp: Optional[requests.Response] = None) -> float:
+    """attempt 回目（0 始まり）の送信失敗後に待つ秒数を返す。"""
+    retry_after = retry_after_seconds(resp)
+    if retry_after is not None:
+        return min(NOTIFY_RETRY_CAP_SECONDS, retry_after)
+    backoff = min(NOTIFY_RETRY_CAP_SECONDS, NOTIFY_RETRY_BASE_SECONDS * 2 ** attempt)
+    return backoff * (1 + random.uniform(0, NOTIFY_RETRY_JITTER))
+
+
+def post_with_retry(url: str, label: str, max_retries: int = 3, **kwargs) -> bool:
+    """url へ POST し、一時障害（429 / 5xx / 例外）の間だけバックオフして再送する。成功なら True。"""
+    for attempt in range(max_retries):
+        resp = None
+        try:
+            resp = _http_session.post(url, **kwargs)
+            if resp.status_code < 400:
+                return True
+            log(f"ERROR: {label} failed (status={resp.status_code}, attempt={attempt + 1}/{max_retries})")
+            if resp.status_code not in RETRYABLE_HTTP_STATUSES:
+                return False
+        except Exception as e:
+            log(f"ERROR: {label} exception: {e} (attempt={attempt + 1}/{max_retries})")
+        if attempt < max_retries - 1:
+            time.sleep(notify_retry_delay(attempt, resp))
+    return False
+
+
+# 通知文面の固定部分（媒体ごとの見出し・メンション）は呼び出しごとに組み立て直さない
+SLACK_TITLES = {"indeed": "【Indeed応募】", "jimoty": "【ジモティー】"}
+SLACK_MENTION_PREFIX = "<!channel>\n"
+LINE_TITLES = {"indeed": "Indeedに応募がありました。", "jimoty": "ジモティーで新着があります。"}
+# textV2 の {mention_all} を @all メンションに置き換える指定（読み取り専用で全通知が共有する）
+_LINE_MENTION_ALL_SUBSTITUTION = {
+    "mention_all": {
+        "type": "mention",
+        "mentionee": {"type": "all"},
+    }
+}
+
+
 def notify_slack_with_retry(source: str, name: str, url: str, job_title: Optional[str] = None, max_retries: int = 3) -> bool:
     """Send notification to Slack with retry logic. Returns True if successful."""
     webhook_url = get_slack_webhook_url()
     if not webhook_url:
         log("No Slack Webhook URL")
         return False
-    title = "【Indeed応募】" if source == "indeed" else "【ジモティー】"
-    mention_prefix = "<!channel>\n"
-
+    title = SLACK_TITLES.get(source, SLACK_TITLES["jimoty"])
     lines = [f"{title} 【{name}】 さんから応募がありました。"]
     if job_title:
         lines.append(f"求人: {job_title}")
     if url:
         lines.extend(["", "応募内容はこちら:", shorten_url(url)])
-    message = add_test_prefix(mention_prefix + "\n".join(lines))
+    message = add_test_prefix(SLACK_MENTION_PREFIX + "\n".join(lines))
     for attempt in range(max_retries):
+        resp = None
         try:
-            resp = _http_session.post(webhook_url, json={"text": message}, timeout=10)
+            resp = _http_session.post(webhook_url, json={"text": message}, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 10))
             if resp.status_code < 400:
                 return True
             log(f"ERROR: Slack notify failed (status={resp.status_code}, body={resp.text}, attempt={attempt + 1}/{max_retries})")
+            if resp.status_code not in RETRYABLE_HTTP_STATUSES:
+                break  # Webhook 無効・ペイロード不正などは再送しても直らない
         except requests.exceptions.Timeout:
             log(f"ERROR: Slack notify timeout (attempt={attempt + 1}/{max_retries})")
         except Exception as e:
             log(f"ERROR: Slack notify exception: {e} (attempt={attempt + 1}/{max_retries})")
         if attempt < max_retries - 1:
-            time.sleep(2 ** attempt)  # Exponential backoff: 1s, 2s
-    notify_error_to_slack(f"Slack notify failed after {max_retries} attempts for {name}")
+            time.sleep(notify_retry_delay(attempt, resp))  # Exponential backoff with jitter: ~1s, ~2s
+    notify_error_to_slack(f"Slack notify failed after {attempt + 1} attempts for {name}")
     return False
 
 
@@ -568,7 +1056,7 @@ def notify_line_with_retry(source: str, name: str, url: str, job_title: Optional
     if not LINE_CHANNEL_ACCESS_TOKEN or not line_to_id:
         log("LINE Token or TO ID missing")
         return False
-    title = "Indeedに応募がありました。" if source == "indeed" else "ジモティーで新着があります。"
+    title = LINE_TITLES.get(source, LINE_TITLES["jimoty"])
     lines = [f"【{name}】 さんから{title}"]
     if job_title:
         lines.append(f"求人: {job_title}")
@@ -585,15 +1073,13 @@ def notify_line_with_retry(source: str, name: str, url: str, job_title: Optional
     }
 
     def _build_body_v2() -> dict:
-        substitution = {
-            "mention_all": {
-                "type": "mention",
-                "mentionee": {"type": "all"},
-            }
-        }
         return {
             "to": line_to_id,
-            "messages": [{"type": "textV2", "text": "{mention_all} " + base_message, "substitution": substitution}],
+            "messages": [{
+                "type": "textV2",
+                "text": "{mention_all} " + base_message,
+                "substitution": _LINE_MENTION_ALL_SUBSTITUTION,
+            }],
         }
 
     def _build_body_plain() -> dict:
@@ -605,10 +1091,12 @@ def notify_line_with_retry(source: str, name: str, url: str, job_title: Optional
         }
 
     for attempt in range(max_retries):
+        resp = None
         # textV2 (@all mention) を試み、失敗したら plain text にフォールバック
         for body_builder, label in [(_build_body_v2, "textV2+mention"), (_build_body_plain, "text(fallback)")]:
+            resp = None
             try:
-                resp = _http_session.post("https://api.line.me/v2/bot/message/push", json=body_builder(), headers=headers, timeout=10)
+                resp = _http_session.post("https://api.line.me/v2/bot/message/push", json=body_builder(), headers=headers, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 10))
                 log(f"LINE API response: status={resp.status_code} type={label}")
                 if resp.status_code < 400:
                     return True
@@ -624,15 +1112,37 @@ def notify_line_with_retry(source: str, name: str, url: str, job_title: Optional
             except Exception as e:
                 log(f"ERROR: LINE notify exception type={label}: {e}")
                 break
+        if resp is not None and resp.status_code not in RETRYABLE_HTTP_STATUSES:
+            break  # トークン無効（401/403）や plain text でも 400 などは再送しても直らない
         if attempt < max_retries - 1:
-            time.sleep(2 ** attempt)
-    notify_error_to_slack(f"LINE notify failed after {max_retries} attempts for {name}")
+            time.sleep(notify_retry_delay(attempt, resp))
+    notify_error_to_slack(f"LINE notify failed after {attempt + 1} attempts for {name}")
     return False
 
 
+# Slack と LINE は独立した HTTP 送信なので並行に送る（通知の遅延が和ではなく max になる）。
+# スレッドは使い回し、_http_session（接続プール）も両スレッドで共有する。
+_notify_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="notify")
+
+
+def notify_all_channels(source: str, name: str, url: str, job_title: Optional[str] = None) -> Tuple[bool, bool]:
+    """Send the notification to Slack and LINE concurrently. Returns (slack_ok, line_ok).
+
+    Each channel keeps its own retry/timeout handling, so the futures are
+    awaited without an extra timeout (abandoning a still-running send could
+    turn into a duplicate notification on the next cycle).
+    """
+    slack_future = _notify_pool.submit(notify_slack_with_retry, source, name, url, job_title=job_title)
+    line_future = _notify_pool.submit(notify_line_with_retry, source, name, url, job_title=job_title)
+    return slack_future.result(), line_future.result()
+
+
 # --- IMAP Connection ---
 # Backoff schedule for IMAP (re)connection attempts (seconds).
 IMAP_CONNECT_BACKOFF_SECONDS = [5, 10, 20]
+# 直前の利用が正常終了してからこの秒数以内なら NOOP による生存確認を省く
+# （IDLE の DONE 完了直後にそのまま SEARCH する場合など、往復1回分の無駄を避ける）。
+IMAP_NOOP_SKIP_SECONDS = 10
 
 
 class IMAPConnectionPool:
@@ -648,11 +1158,12 @@ class IMAPConnectionPool:
 
     def __init__(self) -> None:
         self._connection: Optional[imaplib.IMAP4_SSL] = None
+        self._last_ok: Optional[float] = None  # 最後に正常に使い終えた時刻（time.monotonic）
 
     def get(self) -> imaplib.IMAP4_SSL:
         """Return a live IMAP connection, reusing the existing one if alive."""
         if self._connection is not None:
-            if self._is_alive(self._connection):
+            if self._used_recently() or self._is_alive(self._connection):
                 return self._connection
             log(f"IMAP pooled connection to {GMAIL_IMAP_HOST} is dead; reconnecting")
             self._close_silently()
@@ -663,6 +1174,17 @@ class IMAPConnectionPool:
         """Force-discard the current connection (call after an IMAP error)."""
         self._close_silently()
 
+    def mark_ok(self) -> None:
+        """Record that the pooled connection just completed its commands successfully."""
+        self._last_ok = time.monotonic()
+
+    def _used_recently(self) -> bool:
+        return self._last_ok is not None and time.monotonic() - self._last_ok < IMAP_NOOP_SKIP_SECONDS
+
+    def has_connection(self) -> bool:
+        """Return True if a connection is currently pooled (liveness not checked)."""
+        return self._connection is not None
+
     def _is_alive(self, mail: imaplib.IMAP4_SSL) -> bool:
         try:
             status, _ = mail.noop()
@@ -682,6 +1204,7 @@ class IMAPConnectionPool:
         except Exception:
             pass
         self._connection = None
+        self._last_ok = None
 
     # プロセス内フラグ: OAuth が invalid_grant で失効していることが判明したら True に立てる。
     # これ以降は OAuth を試さずに app-password に直行し、毎ポーリングで無駄な 400 を食わない。
@@ -727,6 +1250,9 @@ class IMAPConnectionPool:
                     mail.login(GMAIL_IMAP_USER, GMAIL_IMAP_PASSWORD)
                     auth_method = "app-password"
                 mail.select("INBOX", readonly=True)
+                # SELECT 応答の EXISTS は現在の総数で新着の合図ではない。残すと imap_idle が
+                # 溜まった EXISTS を新着とみなし、再接続のたびに即座に戻ってしまう。
+                mail.untagged_responses.pop("EXISTS", None)
                 log(f"IMAP connect success host={GMAIL_IMAP_HOST} auth={auth_method} attempt={attempt}/{max_attempts}")
                 return mail
             # RuntimeError/RequestException は OAuth トークン取得失敗（refresh token 失効や
@@ -772,22 +1298,134 @@ def imap_connection():
         except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError):
             _imap_pool.reset()
             raise
+        _imap_pool.mark_ok()
     finally:
         socket.setdefaulttimeout(old_timeout)
 
 
+def _enable_tcp_keepalive(sock: socket.socket) -> None:
+    """IDLE 中の無通信な接続で、NAT/ロードバランサによる無言の切断を数分で検知できるようにする。"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Linux 以外では個別のタイマー設定がない場合があるため、存在するものだけ設定する。
+    for opt_name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 30), ("TCP_KEEPCNT", 4)):
+        opt = getattr(socket, opt_name, None)
+        if opt is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, opt, value)
+
+
+def _wait_imap_readable(mail: imaplib.IMAP4_SSL, timeout: float) -> bool:
+    """IMAP 接続に読める応答が届くまで最大 timeout 秒待つ。届いたら True、時間切れなら False。
+
+    sock.makefile() のストリームは一度 socket.timeout を出すと以後読めなくなるため、
+    readline() にはタイムアウトをかけず、select で読めると分かってから読む。
+    ただし SSL 層や BufferedReader に読み込み済みのデータは select に現れないので先に確認する。
+    """
+    sock = mail.sock
+    pending = getattr(sock, "pending", None)
+    if pending is not None and pending():
+        return True
+    # ノンブロッキングの peek は届いている分だけをバッファへ取り込み、無ければ空で戻る
+    # （この経路のエラーはタイムアウト扱いにならないため、ストリームは使えなくならない）。
+    sock.settimeout(0.0)
+    try:
+        if mail.file.peek(1):
+            return True
+    except (BlockingIOError, ssl.SSLWantReadError):
+        pass
+    finally:
+        sock.settimeout(IMAP_TIMEOUT_SECONDS)
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+
+def imap_idle(mail: imaplib.IMAP4_SSL, timeout: float) -> bool:
+    """IMAP IDLE で新着メールを待つ。新着（EXISTS）を受けたら True、timeout 経過なら False。
+
+    imaplib は IDLE を実装していないため、タグ付き IDLE コマンドを直接送り、
+    継続応答（+）の後は untagged 応答を1行ずつ読む。終了時は必ず DONE を送り、
+    タグ付き完了応答まで読み切ってから接続をプールへ戻す（次のコマンドと応答が混ざらないように）。
+    """
+    # 直前のコマンド（プールの NOOP 等）の応答に含まれた EXISTS は IDLE 中に再通知されないため、
+    # 溜まっていればすぐ戻って取りこぼしを防ぐ。
+    if mail.untagged_responses.pop("EXISTS", None):
+        return True
+    sock = mail.sock
+    _enable_tcp_keepalive(sock)
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail.readline()
+    if not line.startswith(b"+"):
+        mail.tagged_commands.pop(tag, None)
+        raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+
+    got_new = False
+    deadline = time.monotonic() + timeout
+    while not got_new:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _wait_imap_readable(mail, remaining):
+            break
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        # "* 12 EXISTS" のみ新着とみなす（EXPUNGE / FETCH のフラグ変化は無視して待ち続ける）
+        got_new = line.startswith(b"* ") and line.rstrip().endswith(b" EXISTS")
+
+    mail.send(b"DONE\r\n")
+    while True:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed while terminating IDLE")
+        if line.startswith(tag + b" "):
+            break
+    mail.tagged_commands.pop(tag, None)
+    if not line[len(tag) + 1:].startswith(b"OK"):
+        raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+    return got_new
+
+
+def wait_for_new_mail(timeout: float) -> bool:
+    """Wait for new mail via IMAP IDLE on the pooled connection.
+
+    Returns True if the wait was done with IDLE (new mail or timeout), and
+    False if IDLE is disabled, unsupported or failed — the caller should then
+    fall back to the fixed-interval sleep.
+    """
+    # 直前のサイクルで接続できていない（認証失敗など）場合は、ここで再接続のバックオフを
+    # 二重に走らせず、従来どおりのポーリング間隔に任せる。
+    if not IMAP_IDLE_ENABLED or not _imap_pool.has_connection():
+        return False
+    try:
+        with imap_connection() as mail:
+            if "IDLE" not in mail.capabilities:
+                return False
+            got_new = imap_idle(mail, timeout)
+    except (imaplib.IMAP4.error, OSError, RuntimeError, requests.RequestException) as e:
+        log(f"WARN: IMAP IDLE failed; falling back to polling: {e!r}")
+        return False
+    log(f"IMAP IDLE: {'new mail' if got_new else 'timeout'}; checking mailbox")
+    return True
+
+
 # --- Mail Processing ---
+# FETCH 応答行（bytes）から値を抜き出す正規表現。応答行は decode せず bytes のまま照合する。
+_RE_GM_MSGID = re.compile(rb"X-GM-MSGID (\d+)")
+_RE_UID = re.compile(rb"UID (\d+)")
+
+
+def _as_bytes(value) -> bytes:
+    """imaplib の応答要素（通常 bytes、テスト等では str）を bytes に揃える。"""
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
 def parse_fetch_response(data: list) -> Tuple[Optional[str], Optional[bytes]]:
     """Parse IMAP fetch response to extract X-GM-MSGID and body."""
     gm_msgid = None
     body_data = None
     for item in data:
         if isinstance(item, tuple):
-            header = item[0].decode() if isinstance(item[0], bytes) else item[0]
-            if "X-GM-MSGID" in header:
-                match = re.search(r"X-GM-MSGID (\d+)", header)
-                if match:
-                    gm_msgid = match.group(1)
+            match = _RE_GM_MSGID.search(_as_bytes(item[0]))
+            if match:
+                gm_msgid = match.group(1).decode("ascii")
             # Only set body_data on first non-None value to avoid overwriting with later empty tuples
             if body_data is None and len(item) > 1:
                 body_data = item[1]
@@ -806,6 +1444,7 @@ INDEED_APPLICATION_PATTERNS = [
     "新規応募",
     "応募が届きました",
 ]
+_INDEED_APPLICATION_RE = re.compile("|".join(map(re.escape, INDEED_APPLICATION_PATTERNS)))
 
 # Indeed が件名フォーマットを変えても応募通知を取りこぼさないための正規表現フォールバック。
 # 固定フレーズ（INDEED_APPLICATION_PATTERNS）に一致しなくても、「応募」と
@@ -824,7 +1463,7 @@ def _looks_like_indeed_application(subject: str) -> bool:
     既知の非応募パターン（認証コード・課金・レコメンド等）に該当する件名は、
     フォーマット変化に強くしても応募と誤判定しないよう先に除外する。
     """
-    if any(pattern in subject for pattern in INDEED_APPLICATION_PATTERNS):
+    if _INDEED_APPLICATION_RE.search(subject):
         return True
     if is_indeed_non_application_email(subject):
         return False
@@ -871,7 +1510,7 @@ def is_indeed_non_application_email(subject: str) -> bool:
     These include recommendation emails, status reports, billing notices, etc.
     Returns True if the subject matches any known non-application pattern.
     """
-    return any(pattern in subject for pattern in INDEED_NON_APPLICATION_PATTERNS)
+    return _INDEED_NON_APPLICATION_RE.search(subject) is not None
 
 
 def get_unique_id(gm_msgid: Optional[str], msg: email.message.Message) -> Optional[str]:
@@ -903,7 +1542,98 @@ def process_mail_by_uid(
         log(f"ERROR: Failed to fetch body for uid={uid_str}")
         return None
 
-    msg = email.message_from_bytes(body_data)
+    return process_parsed_mail(uid_str, gm_msgid, body_data, processed_ids)
+
+
+# 分類に必要なヘッダだけを取得する FETCH 項目（件名・差出人で判定、Message-ID は一意ID、Date はアラート用）
+MAIL_HEADERS_FETCH_ITEM = "BODY.PEEK[HEADER.FIELDS (SUBJECT FROM MESSAGE-ID DATE)]"
+
+
+def fetch_bodies_batch(
+    mail: imaplib.IMAP4_SSL,
+    uids: list,
+    fetch_item: str = "BODY.PEEK[]"
+) -> Dict[str, Tuple[Optional[str], bytes]]:
+    """複数 UID の X-GM-MSGID と本文をまとめて取得する（1チャンク=1往復）。
+
+    fetch_item に MAIL_HEADERS_FETCH_ITEM を渡すと、本文の代わりに分類用ヘッダだけを取得する。
+
+    UID FETCH の応答は「(ヘッダ行, 本文リテラル)」のタプルと閉じ括弧 b")" が
+    メッセージごとに並ぶ。UID はヘッダ行に入るのが通常だが、サーバによっては
+    リテラルの後ろ（閉じ括弧側の行）に来るため、その場合は直前の本文に対応付ける。
+
+    Returns:
+        {uid_str: (gm_msgid or None, body_bytes)}。本文を取得できなかった UID は含まれない。
+    """
+    result: Dict[str, Tuple[Optional[str], bytes]] = {}
+    uid_strs = [uid.decode() if isinstance(uid, bytes) else str(uid) for uid in uids]
+    for chunk in _chunked(uid_strs, IMAP_FETCH_CHUNK_SIZE):
+        status, data = mail.uid("fetch", ",".join(chunk), f"(X-GM-MSGID {fetch_item})")
+        if status != "OK":
+            log(f"ERROR: Batched body fetch failed for {len(chunk)} UIDs, status={status}")
+            continue
+        pending: Optional[Tuple[Optional[str], bytes]] = None  # UID 未確定の直前メッセージ
+        for item in data:
+            if isinstance(item, tuple):
+                header = _as_bytes(item[0])
+                body = item[1] if len(item) > 1 else None
+            elif isinstance(item, bytes):
+                header, body = item, None
+            else:
+                continue
+            gm_match = _RE_GM_MSGID.search(header)
+            uid_match = _RE_UID.search(header)
+            if body is not None:
+                pending = (gm_match.group(1).decode("ascii") if gm_match else None, body)
+            if uid_match and pending is not None:
+                gm_msgid, body_data = pending
+                if gm_msgid is None and gm_match:
+                    gm_msgid = gm_match.group(1).decode("ascii")
+                if body_data:
+                    result[uid_match.group(1).decode("ascii")] = (gm_msgid, body_data)
+                pending = None
+    return result
+
+
+# 分類・重複判定に要るのはヘッダだけなので、本文（MIME 構造・添付）は解析しないパーサを使う
+_HEADER_PARSER = BytesHeaderParser()
+
+
+def mail_needs_body(gm_msgid: Optional[str], header_data: bytes, processed_ids: Set[str]) -> bool:
+    """ヘッダだけでは処理できない（本文の HTML が必要な）メールかを判定する。
+
+    本文が要るのは Indeed の応募通知（応募者名・URL）と、通常チャネルへまだ通知していない
+    未分類の Indeed メール（URL）だけ。ジモティー・対象外メール・既知の非応募 Indeed メール・
+    処理済みメールはヘッダだけで process_parsed_mail() の結果が決まる。
+    """
+    msg = _HEADER_PARSER.parsebytes(header_data)
+    unique_id = get_unique_id(gm_msgid, msg)
+    if not unique_id or unique_id in processed_ids:
+        return False
+    subject = decode_header_value(msg.get("Subject", ""))
+    source, _ = determine_source(subject)
+    if source:
+        return source == "indeed"
+    if not is_from_indeed(decode_header_value(msg.get("From", ""))):
+        return False
+    if is_indeed_non_application_email(subject):
+        return False
+    return unique_id not in _unclassified_normal_notified
+
+
+def process_parsed_mail(
+    uid_str: str,
+    gm_msgid: Optional[str],
+    body_data: bytes,
+    processed_ids: Set[str]
+) -> Optional[str]:
+    """取得済みのメール本文を処理する。Returns unique ID if processed, None otherwise.
+
+    IMAP への FETCH は呼び出し側（process_mail_by_uid / バッチ FETCH）が済ませており、
+    ここでは解析・分類・通知のみを行う。ヘッダだけで分類し、本文の MIME 解析は
+    HTML が必要な Indeed メールの時だけ行う。
+    """
+    msg = _HEADER_PARSER.parsebytes(body_data)
 
     # Get unique identifier (X-GM-MSGID or Message-ID)
     unique_id = get_unique_id(gm_msgid, msg)
@@ -914,7 +1644,7 @@ def process_mail_by_uid(
     # Double-check with X-GM-MSGID/Message-ID (in case UID tracking missed it)
     if unique_id in processed_ids:
         log(f"Already processed (skip): uid={uid_str}, id={unique_id}")
-        return None
+        return unique_id  # 呼び出し側で uid: キャッシュだけ補完させる（次サイクルで再取得しない）
 
     subject = decode_header_value(msg.get("Subject", ""))
     from_header = decode_header_value(msg.get("From", ""))
@@ -951,14 +1681,13 @@ def process_mail_by_uid(
                 notify_error_to_slack(alert_msg, dedup_key=dedup_key)
                 # 通常チャネルには初回のみ送信（2サイクル目以降は抑制）
                 if unique_id not in _unclassified_normal_notified:
-                    html = extract_html(msg)
+                    html = extract_html(email.message_from_bytes(body_data))
                     url = extract_indeed_url(html) or ""
                     unclassified_name = "⚠️未分類のIndeedメール（要確認）"
-                    notify_slack_with_retry("indeed", unclassified_name, url)
-                    notify_line_with_retry("indeed", unclassified_name, url)
+                    notify_all_channels("indeed", unclassified_name, url)
                     _unclassified_normal_notified.add(unique_id)
                     processed_ids.add(f"unclf:{unique_id}")
-                    save_processed_ids(processed_ids)
+                    append_processed_ids(processed_ids, [f"unclf:{unique_id}"])
                     log(f"Normal channel notified (first time) for unclassified: {unique_id}")
                 else:
                     log(f"Normal channel skip (already notified) for unclassified: {unique_id}")
@@ -967,7 +1696,8 @@ def process_mail_by_uid(
             log(f"Skip non-target mail: {subject[:50]}...")
             return unique_id  # Indeed以外の対象外メールは静かにスキップ＋処理済みマーク
 
-    html = extract_html(msg)
+    # ジモティーは URL 固定・応募者名は From から取るので本文を解析しない
+    html = extract_html(email.message_from_bytes(body_data)) if source == "indeed" else ""
     url = extract_indeed_url(html) if source == "indeed" else default_url
 
     # IndeedメールはFrom=「Indeed <noreply@indeed.com>」なので
@@ -984,8 +1714,7 @@ def process_mail_by_uid(
 
     log(f"Notify {source}: job={job_title}, id={unique_id}")
 
-    slack_ok = notify_slack_with_retry(source, applicant_name, url, job_title=job_title)
-    line_ok = notify_line_with_retry(source, applicant_name, url, job_title=job_title)
+    slack_ok, line_ok = notify_all_channels(source, applicant_name, url, job_title=job_title)
 
     if not slack_ok and not line_ok:
         log(f"ERROR: All notifications failed for id={unique_id}, will retry next cycle")
@@ -1009,105 +1738,232 @@ def process_mail_by_uid(
         )
         if SLACK_DM_WEBHOOK_URL:
             try:
-                _http_session.post(SLACK_DM_WEBHOOK_URL, json={"text": dm_detail}, timeout=5)
+                _http_session.post(SLACK_DM_WEBHOOK_URL, json={"text": dm_detail}, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, 5))
             except Exception as e:
                 log(f"ERROR: Failed to send detail DM: {e}")
 
     return unique_id
 
 
-def get_gm_msgid_lightweight(mail: imaplib.IMAP4_SSL, uid: str) -> Optional[str]:
-    """Fetch only X-GM-MSGID for a single email (lightweight, no body)."""
-    status, data = mail.uid("fetch", uid, "(X-GM-MSGID)")
-    if status != "OK":
-        return None
-    for item in data:
-        if isinstance(item, tuple):
-            header = item[0].decode() if isinstance(item[0], bytes) else str(item[0])
-        elif isinstance(item, bytes):
-            header = item.decode(errors="replace")
-        else:
+# 1回の UID FETCH に載せる UID 数の上限（IMAP コマンド行長の制限対策）。
+IMAP_FETCH_CHUNK_SIZE = 500
+
+
+def _chunked(items: list, size: int):
+    """items を size 件ずつのスライスに分割して返す。"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def fetch_gm_msgids_batch(mail: imaplib.IMAP4_SSL, uids: list) -> Dict[str, str]:
+    """複数 UID の X-GM-MSGID をまとめて取得する（本文なし・軽量）。
+
+    UID ごとに `UID FETCH <uid> (X-GM-MSGID)` を発行すると候補数ぶん IMAP 往復が
+    発生するため、UID をカンマ区切りの集合にまとめて1コマンド（IMAP_FETCH_CHUNK_SIZE
+    件ごと）で取得する。UID FETCH の応答には UID が必ず含まれるので、応答行から
+    UID と X-GM-MSGID を対応付けて返す。
+
+    Returns:
+        {uid_str: "gm:<X-GM-MSGID>"}。取得できなかった UID はキーに含まれない。
+    """
+    result: Dict[str, str] = {}
+    uid_strs = [uid.decode() if isinstance(uid, bytes) else str(uid) for uid in uids]
+    for chunk in _chunked(uid_strs, IMAP_FETCH_CHUNK_SIZE):
+        status, data = mail.uid("fetch", ",".join(chunk), "(X-GM-MSGID)")
+        if status != "OK":
+            log(f"ERROR: Batched X-GM-MSGID fetch failed for {len(chunk)} UIDs, status={status}")
             continue
-        match = re.search(r"X-GM-MSGID (\d+)", header)
-        if match:
-            return f"gm:{match.group(1)}"
-    return None
+        for item in data:
+            if isinstance(item, tuple):
+                line = item[0]
+            elif isinstance(item, bytes):
+                line = item
+            else:
+                continue
+            header = _as_bytes(line)
+            uid_match = _RE_UID.search(header)
+            gm_match = _RE_GM_MSGID.search(header)
+            if uid_match and gm_match:
+                result[uid_match.group(1).decode("ascii")] = f"gm:{gm_match.group(1).decode('ascii')}"
+    return result
+
+
+def bootstrap_uid_cache(
+    mail: imaplib.IMAP4_SSL,
+    uids: list,
+    processed_ids: Set[str]
+) -> list:
+    """Phase 2: X-GM-MSGID だけを取得し、処理済みメールに uid: エントリを補完する。
+
+    本文 FETCH の前に gm: で処理済みを判定することで、uid: キャッシュを持たない
+    処理済みメール（起動直後など）の全文取得を避ける。候補 UID は1回のバッチ FETCH で
+    まとめて照会する。本当に新しい UID のリストを返す。uid: はセッション内キャッシュで
+    永続化しないため、ここではファイルに書かない。
+    """
+    truly_new_uids = []
+    uids_to_mark = []  # UIDs that are already processed but need uid: entry added
+
+    gm_ids_by_uid = fetch_gm_msgids_batch(mail, uids)
+    for uid in uids:
+        uid_str = uid.decode() if isinstance(uid, bytes) else uid
+        gm_id = gm_ids_by_uid.get(uid_str)
+        if gm_id and gm_id in processed_ids:
+            # Already processed (has gm: entry), just need to add uid: entry
+            uids_to_mark.append(uid_str)
+        else:
+            # Truly new email, needs full processing
+            truly_new_uids.append(uid)
+
+    # Add uid: entries for already-processed emails (bootstrap)
+    if uids_to_mark:
+        log(f"Bootstrapping {len(uids_to_mark)} UIDs for already-processed emails")
+        for uid_str in uids_to_mark:
+            processed_ids.add(f"uid:{uid_str}")
+    return truly_new_uids
+
+
+def search_uids_since(mail: imaplib.IMAP4_SSL, since_date: str,
+                      min_uid: Optional[int] = None) -> Tuple[str, list]:
+    """UID SEARCH SINCE を発行する。IMAP_SEARCH_GM_RAW があれば Gmail 検索クエリでも絞り込む。
+
+    min_uid を渡すと UID min_uid:* も条件に加え、それより前のメールはサーバ側で除外する。
+    """
+    criteria = ["SINCE", since_date]
+    if min_uid is not None:
+        criteria = ["UID", f"{min_uid}:*"] + criteria
+    if not IMAP_SEARCH_GM_RAW:
+        return mail.uid("search", None, *criteria)
+    # 日本語を含むクエリは UTF-8 リテラルで送る（imaplib はコマンド末尾に {n} リテラルとして付ける）
+    mail.literal = IMAP_SEARCH_GM_RAW.encode("utf-8")
+    return mail.uid("search", "CHARSET", "UTF-8", *criteria, "X-GM-RAW")
+
+
+# Phase 2（X-GM-MSGID による uid: キャッシュのブートストラップ）をこのプロセスで済ませたか。
+# 一度済めば検索窓内の処理済みメールは全て uid: を持つため、以降 Phase 1 を通過する UID は
+# 新着（または再処理待ち）だけになり、Phase 2 の FETCH は毎回空振りの往復になる。
+_bootstrap_done = False
+# 直近の clean なサイクルで見た最大 UID と、その時の INBOX の UIDVALIDITY。
+# これ以下の UID は処理済み（またはスキップ対象）と確定しているので、次サイクルの SEARCH は
+# UID がこれより大きいメールだけに絞る。UIDVALIDITY が変われば UID が振り直されているので使わない。
+_clean_uid: Optional[Tuple[bytes, int]] = None
+# 直近の check_mail_with_status が clean に完走したか。False の間はメインループが IDLE で
+# 最長 IMAP_IDLE_TIMEOUT_SECONDS 待たず、POLL_INTERVAL_SECONDS 後に拾い直す。
+_last_cycle_clean = False
+
+
+def get_uidvalidity(mail: imaplib.IMAP4_SSL) -> Optional[bytes]:
+    """SELECT 応答で受け取った INBOX の UIDVALIDITY。分からなければ None。"""
+    values = mail.untagged_responses.get("UIDVALIDITY")
+    if not isinstance(values, list) or not values or not isinstance(values[-1], bytes):
+        return None
+    return values[-1]
 
 
-def _check_mail_attempt(processed_ids: Set[str]) -> None:
+def _check_mail_attempt(processed_ids: Set[str]) -> bool:
     """1サイクル分のメール処理本体。接続/IMAPエラーは呼び出し側でリトライさせるため再送出する。
 
-    成功・部分成功・スキップは全て return（None）で抜ける。
+    成功・部分成功・スキップは全て return で抜け、取りこぼしなく完走した（clean な）サイクルなら True、
+    繰り越し・取得失敗・通知失敗・未分類・保存失敗で次サイクルに拾い直すメールが残るなら False を返す。
     """
+    global _bootstrap_done, _clean_uid
     with imap_connection() as mail:
+        # ここまでに届いた EXISTS（プールの NOOP 等）のメールはこのサイクルの SEARCH で拾うので捨て、
+        # 続く imap_idle にはサイクル中に届いた分だけを新着として残す。
+        mail.untagged_responses.pop("EXISTS", None)
+
         since_date = (datetime.now(timezone.utc) - timedelta(days=SEARCH_DAYS)).strftime("%d-%b-%Y")
 
+        uidvalidity = get_uidvalidity(mail)
+        last_uid = 0
+        if uidvalidity is not None and _clean_uid is not None and _clean_uid[0] == uidvalidity:
+            last_uid = _clean_uid[1]
+
         # Use UID SEARCH for stable identifiers
-        status, data = mail.uid("search", None, "SINCE", since_date)
+        status, data = search_uids_since(mail, since_date, last_uid + 1 if last_uid else None)
         if status != "OK":
             log(f"ERROR: UID SEARCH failed with status: {status}")
-            return
-        uid_list = data[0].split()
-        log(f"Emails in last {SEARCH_DAYS} days: {len(uid_list)}")
+            return False
+        # UID はここで一度だけ str にし、以降のフィルタ・FETCH・uid: キーでそのまま使う
+        uid_list = _as_bytes(data[0]).decode("ascii").split()
+        if last_uid:
+            # "n:*" は n より大きい UID が無くても最大 UID を1件返すので、手元でも絞る
+            uid_list = [uid for uid in uid_list if int(uid) > last_uid]
+            log(f"Emails in last {SEARCH_DAYS} days after uid {last_uid}: {len(uid_list)}")
+        else:
+            log(f"Emails in last {SEARCH_DAYS} days: {len(uid_list)}")
+        if uidvalidity is not None:
+            cycle_uid = (uidvalidity, max([int(uid) for uid in uid_list], default=last_uid))
 
         # Phase 1: Quick filter by UID (for emails we've seen before)
-        uids_to_check = []
-        for uid in uid_list:
-            uid_str = uid.decode() if isinstance(uid, bytes) else uid
-            if f"uid:{uid_str}" not in processed_ids:
-                uids_to_check.append(uid)
+        uids_to_check = [uid for uid in uid_list if f"uid:{uid}" not in processed_ids]
 
         if not uids_to_check:
-            return  # All emails already processed
+            if uidvalidity is not None:
+                _clean_uid = cycle_uid
+            _bootstrap_done = True
+            return True  # All emails already processed
 
         log(f"UIDs not in cache: {len(uids_to_check)}")
 
         # Phase 2: Lightweight check - fetch only X-GM-MSGID to filter by gm: prefix
-        # This avoids full FETCH for emails that are already processed but missing uid: entry
-        truly_new_uids = []
-        uids_to_mark = []  # UIDs that are already processed but need uid: entry added
-
-        for uid in uids_to_check:
-            uid_str = uid.decode() if isinstance(uid, bytes) else uid
-            gm_id = get_gm_msgid_lightweight(mail, uid_str)
-            if gm_id and gm_id in processed_ids:
-                # Already processed (has gm: entry), just need to add uid: entry
-                uids_to_mark.append((uid_str, gm_id))
-            else:
-                # Truly new email, needs full processing
-                truly_new_uids.append(uid)
-
-        # Add uid: entries for already-processed emails (bootstrap)
-        if uids_to_mark:
-            log(f"Bootstrapping {len(uids_to_mark)} UIDs for already-processed emails")
-            for uid_str, gm_id in uids_to_mark:
-                processed_ids.add(f"uid:{uid_str}")
-            if not save_processed_ids(processed_ids):
-                log("ERROR: Failed to save bootstrapped UIDs")
-                return
+        # (only until this process has bootstrapped its uid: cache)
+        if _bootstrap_done:
+            truly_new_uids = uids_to_check
+        else:
+            truly_new_uids = bootstrap_uid_cache(mail, uids_to_check, processed_ids)
+            _bootstrap_done = True
 
+        clean = True
         if truly_new_uids:
             total_new = len(truly_new_uids)
             # QUOTA ERROR対策: 1サイクルで処理するメール数を制限する
             batch = truly_new_uids[:MAX_EMAILS_PER_CYCLE]
             if total_new > MAX_EMAILS_PER_CYCLE:
+                clean = False
                 log(f"Truly new emails to process: {total_new} (processing {MAX_EMAILS_PER_CYCLE} this cycle, {total_new - MAX_EMAILS_PER_CYCLE} deferred)")
             else:
                 log(f"Truly new emails to process: {total_new}")
 
             # Phase 3: Full processing for truly new emails only (batch limited)
-            for uid in batch:
-                uid_str = uid.decode() if isinstance(uid, bytes) else uid
-                unique_id = process_mail_by_uid(mail, uid, processed_ids)
-                if unique_id:
+            # まず分類用ヘッダだけをバッチ取得し、本文の HTML が必要なメールだけ2回目の
+            # バッチ FETCH で本文を取得する（対象外メールは本文を転送・MIME 解析しない）。
+            headers = fetch_bodies_batch(mail, batch, MAIL_HEADERS_FETCH_ITEM)
+            body_uids = [
+                uid for uid in batch
+                if uid in headers and mail_needs_body(*headers[uid], processed_ids)
+            ]
+            bodies = fetch_bodies_batch(mail, body_uids) if body_uids else {}
+            body_uid_set = set(body_uids)
+            for uid_str in batch:
+                if uid_str in bodies:
+                    gm_msgid, body_data = bodies[uid_str]
+                elif uid_str in headers and uid_str not in body_uid_set:
+                    gm_msgid, body_data = headers[uid_str]
+                else:
+                    log(f"ERROR: Failed to fetch body for uid={uid_str}")
+                    clean = False
+                    continue
+                unique_id = process_parsed_mail(uid_str, gm_msgid, body_data, processed_ids)
+                if unique_id in processed_ids:
+                    # 処理済み（gm:/mid: で二重チェックに掛かった）: uid: キャッシュだけ補完する
+                    processed_ids.add(f"uid:{uid_str}")
+                elif unique_id:
                     # Store both the unique_id (gm: or mid:) and the uid for efficient filtering
                     processed_ids.add(unique_id)
                     processed_ids.add(f"uid:{uid_str}")
                     # Save immediately after each email to prevent duplicates on crash
-                    if not save_processed_ids(processed_ids):
+                    # (append-only journal: O(1) per email instead of rewriting the whole set)
+                    if not append_processed_ids(processed_ids, [unique_id]):
                         # If save fails, stop processing to prevent more potential duplicates
                         log("ERROR: Stopping mail processing due to save failure")
-                        return
+                        return False
+                else:
+                    # 通知失敗・未分類などで次サイクルに拾い直すメールが残っている
+                    clean = False
+        if clean:
+            if uidvalidity is not None:
+                _clean_uid = cycle_uid
+        return clean
 
 
 def check_mail_with_status(processed_ids: Optional[Set[str]] = None) -> bool:
@@ -1120,6 +1976,8 @@ def check_mail_with_status(processed_ids: Optional[Set[str]] = None) -> bool:
         processed_ids: 起動時にロード済みの処理済みID集合。Noneのとき（後方互換・テスト用）は
             従来どおり内部でロードする。main()からはこの引数で渡してサイクル間でメモリ保持する。
     """
+    global _last_cycle_clean
+    _last_cycle_clean = False  # 下の _check_mail_attempt が完走した時だけ結果で上書きする
     try:
         # 資格情報が未設定なら、リトライで叩かず即座に分かりやすく通知する
         if not has_imap_credentials():
@@ -1155,7 +2013,7 @@ def check_mail_with_status(processed_ids: Optional[Set[str]] = None) -> bool:
         last_conn_error: Optional[BaseException] = None
         for attempt_idx in range(total_attempts):
             try:
-                _check_mail_attempt(processed_ids)
+                _last_cycle_clean = _check_mail_attempt(processed_ids)
                 return True
             except imaplib.IMAP4.abort:
                 # quota / abort は別ハンドラへ
@@ -1247,8 +2105,23 @@ def verify_storage() -> bool:
 
 
 # --- Main loop ---
+# SIGTERM（Railway のデプロイ/停止）を受けた時、サイクルの途中なら通知・processed_ids の
+# 記録が終わるまで待ってから抜ける。通知だけ送って記録前に落ちると再起動後に二重通知になる。
+_in_cycle = False
+_shutdown_requested = False
+
+
+def _handle_sigterm(signum, frame) -> None:
+    """Exit now while idle; during a mail cycle, let main() exit once the cycle finishes."""
+    global _shutdown_requested
+    _shutdown_requested = True
+    log(f"Received signal {signum}; shutting down{' after the current cycle' if _in_cycle else ''}")
+    if not _in_cycle:
+        raise SystemExit(0)
+
+
 def main() -> None:
-    """Main polling loop with exponential backoff for quota errors."""
+    """Verify storage, load processed IDs, then poll until SIGTERM."""
     log(f"Starting Gmail polling with POLL_INTERVAL_SECONDS={POLL_INTERVAL_SECONDS}")
     log(f"MODE={MODE}, SEARCH_DAYS={SEARCH_DAYS}, MAX_BACKOFF_SECONDS={MAX_BACKOFF_SECONDS}, MAX_EMAILS_PER_CYCLE={MAX_EMAILS_PER_CYCLE}")
     log(f"Gmail auth method: {'OAuth2 (XOAUTH2 refresh token)' if use_oauth() else 'app-password (IMAP LOGIN)'}")
@@ -1270,32 +2143,61 @@ def main() -> None:
         sys.exit(1)
     log(f"Loaded {len(startup_ids)} processed IDs into memory at startup")
 
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    try:
+        _poll_forever(startup_ids)
+    finally:
+        # 送信中の通知スレッドを待ってから終了する
+        _notify_pool.shutdown(wait=True)
+        log("Stopped Gmail polling")
+
+
+def main_loop_backoff(consecutive_errors: int) -> float:
+    """連続失敗回数に応じた待ち秒数（指数）に ±20% のジッタを掛ける。上限は MAX_BACKOFF_SECONDS。
+
+    複数インスタンスや Gmail 障害明けの再接続が同じ間隔で揃って押し寄せないようにする。
+    ジッタ後にも上限で切り、最大待ち時間が MAX_BACKOFF_SECONDS を超えないようにする。
+    """
+    backoff = min(POLL_INTERVAL_SECONDS * (2 ** consecutive_errors), MAX_BACKOFF_SECONDS)
+    return min(MAX_BACKOFF_SECONDS, backoff * random.uniform(0.8, 1.2))
+
+
+def _poll_forever(startup_ids: Set[str]) -> None:
+    """Main polling loop with exponential backoff for quota errors. Returns after SIGTERM."""
+    global _in_cycle
     consecutive_errors = 0
     quota_notified = False
-    while True:
+    while not _shutdown_requested:
         try:
             _cycle_start = time.monotonic()
-            success = check_mail_with_status(startup_ids)
+            _in_cycle = True
+            try:
+                success = check_mail_with_status(startup_ids)
+            finally:
+                _in_cycle = False
+            if _shutdown_requested:
+                return
             _elapsed = time.monotonic() - _cycle_start
             if success:
                 consecutive_errors = 0
                 quota_notified = False
-                time.sleep(max(0, POLL_INTERVAL_SECONDS - _elapsed))
+                # 拾い残し（繰り越し・通知失敗等）があるサイクルの後は IDLE で待たずに通常間隔で拾い直す
+                if not (_last_cycle_clean and wait_for_new_mail(IMAP_IDLE_TIMEOUT_SECONDS)):
+                    time.sleep(max(0, POLL_INTERVAL_SECONDS - _elapsed))
             else:
                 # Error occurred, apply exponential backoff
                 consecutive_errors += 1
-                backoff = min(POLL_INTERVAL_SECONDS * (2 ** consecutive_errors), MAX_BACKOFF_SECONDS)
-                log(f"Backoff: waiting {backoff} seconds (consecutive_errors={consecutive_errors})")
+                backoff = main_loop_backoff(consecutive_errors)
+                log(f"Backoff: waiting {backoff:.0f} seconds (consecutive_errors={consecutive_errors})")
                 # Notify once when quota error starts
                 if not quota_notified:
-                    notify_error_to_slack(f"Gmail quota exceeded. Applying backoff ({backoff}s). Will retry automatically.")
+                    notify_error_to_slack(f"Gmail quota exceeded. Applying backoff ({backoff:.0f}s). Will retry automatically.")
                     quota_notified = True
                 time.sleep(max(0, backoff - _elapsed))
         except Exception as e:
             log(f"ERROR in main loop: {e}")
             consecutive_errors += 1
-            backoff = min(POLL_INTERVAL_SECONDS * (2 ** consecutive_errors), MAX_BACKOFF_SECONDS)
-            time.sleep(backoff)
+            time.sleep(main_loop_backoff(consecutive_errors))
 
 
 if __name__ == "__main__":
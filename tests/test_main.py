@@ -7,6 +7,7 @@ from unittest.mock import MagicMock, patch
 import email
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.parser import BytesParser
 
 import pytest
 
@@ -27,6 +28,8 @@ from src.main import (
     parse_fetch_response,
     load_processed_ids,
     save_processed_ids,
+    append_processed_ids,
+    get_processed_ids_journal_path,
     ensure_processed_ids_dir,
     get_unique_id,
     verify_storage,
@@ -51,6 +54,31 @@ class TestDecodeHeaderValue:
     def test_plain_ascii(self):
         assert decode_header_value("Hello World") == "Hello World"
 
+    def test_encoded_value_is_decoded_once(self):
+        from src.main import _decode_encoded_header
+        import src.main
+        _decode_encoded_header.cache_clear()
+        encoded = "=?UTF-8?B?44GT44KT44Gr44Gh44Gv?="
+        with patch("src.main.decode_header", wraps=src.main.decode_header) as mock_decode:
+            assert decode_header_value(encoded) == "こんにちは"
+            assert decode_header_value(encoded) == "こんにちは"
+        assert mock_decode.call_count == 1
+        _decode_encoded_header.cache_clear()
+
+    def test_raw_utf8_header_is_decoded(self):
+        """エンコードされていない生の UTF-8 件名（compat32 では unknown-8bit）も読めること"""
+        msg = email.message_from_bytes("Subject: 新しい応募者のお知らせ\r\n\r\n".encode("utf-8"))
+        assert decode_header_value(msg.get("Subject")) == "新しい応募者のお知らせ"
+
+    def test_unknown_charset_falls_back_to_utf8(self):
+        from src.main import _decode_header_bytes
+        assert _decode_header_bytes("テスト".encode("utf-8"), "x-unknown") == "テスト"
+
+    def test_plain_value_skips_decode_header(self):
+        with patch("src.main.decode_header") as mock_decode:
+            assert decode_header_value("Indeed <noreply@indeed.com>") == "Indeed <noreply@indeed.com>"
+        mock_decode.assert_not_called()
+
     def test_japanese_encoded(self):
         encoded = "=?UTF-8?B?44GT44KT44Gr44Gh44Gv?="
         result = decode_header_value(encoded)
@@ -80,19 +108,48 @@ class TestExtractName:
         assert extract_name("田中 太郎 <tanaka@example.com>") == "田中 太郎"
 
 
+# 本番（email.message_from_bytes）と同じ経路で組み立てるため、フィクスチャは生のバイト列から解析する
+_SIMPLE_HTML_BYTES = (
+    b"MIME-Version: 1.0\r\n"
+    b"Content-Type: text/html; charset=utf-8\r\n"
+    b"\r\n"
+    b"<html><body>Hello</body></html>\r\n"
+)
+_MULTIPART_BYTES = (
+    b"MIME-Version: 1.0\r\n"
+    b"Content-Type: multipart/alternative; boundary=B\r\n"
+    b"\r\n"
+    b"--B\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n"
+    b"\r\n"
+    b"Plain text\r\n"
+    b"--B\r\n"
+    b"Content-Type: text/html; charset=utf-8\r\n"
+    b"\r\n"
+    b"<html><body>HTML content</body></html>\r\n"
+    b"--B--\r\n"
+)
+
+
+@pytest.fixture(scope="module")
+def simple_html_msg():
+    """Single-part text/html message (shared read-only across tests; do not mutate)."""
+    return BytesParser().parsebytes(_SIMPLE_HTML_BYTES)
+
+
+@pytest.fixture(scope="module")
+def multipart_msg():
+    """multipart/alternative with text/plain + text/html parts (shared read-only; do not mutate)."""
+    return BytesParser().parsebytes(_MULTIPART_BYTES)
+
+
 class TestExtractHtml:
-    def test_simple_html_message(self):
-        msg = MIMEText("<html><body>Hello</body></html>", "html")
-        result = extract_html(msg)
+    def test_simple_html_message(self, simple_html_msg):
+        result = extract_html(simple_html_msg)
         assert "Hello" in result
 
-    def test_multipart_message(self):
-        msg = MIMEMultipart("alternative")
-        text_part = MIMEText("Plain text", "plain")
-        html_part = MIMEText("<html><body>HTML content</body></html>", "html")
-        msg.attach(text_part)
-        msg.attach(html_part)
-        result = extract_html(msg)
+    def test_multipart_message(self, multipart_msg):
+        result = extract_html(multipart_msg)
         assert "HTML content" in result
 
     def test_plain_text_only(self):
@@ -100,44 +157,97 @@ class TestExtractHtml:
         result = extract_html(msg)
         assert result == ""
 
+    def test_html_attachment_is_skipped(self):
+        msg = MIMEMultipart("mixed")
+        attachment = MIMEText("<html><body>Attached</body></html>", "html")
+        attachment.add_header("Content-Disposition", "attachment", filename="resume.html")
+        msg.attach(attachment)
+        msg.attach(MIMEText("<html><body>Body</body></html>", "html"))
+        assert "Body" in extract_html(msg)
+
 
 class TestExtractIndeedUrl:
-    def test_empty_html(self):
-        assert extract_indeed_url("") == ""
-        assert extract_indeed_url(None) == ""
-
-    def test_with_application_button(self):
-        html = '''
-        <html>
-        <body>
-            <a href="https://indeed.com/apply/123">応募内容を確認する</a>
-        </body>
-        </html>
-        '''
-        result = extract_indeed_url(html)
-        assert result == "https://indeed.com/apply/123"
-
-    def test_fallback_indeed_link(self):
-        html = '''
-        <html>
-        <body>
-            <a href="https://indeed.com/job/456">View Job</a>
-        </body>
-        </html>
-        '''
-        result = extract_indeed_url(html)
-        assert "indeed" in result
-
-    def test_no_indeed_link(self):
-        html = '''
-        <html>
-        <body>
-            <a href="https://example.com">Some link</a>
-        </body>
-        </html>
-        '''
-        result = extract_indeed_url(html)
-        assert result == ""
+    @pytest.mark.parametrize("html,expected", [
+        ("", ""),
+        (None, ""),
+        ('<html><body><a href="https://indeed.com/apply/123">応募内容を確認する</a></body></html>',
+         "https://indeed.com/apply/123"),
+        ('<html><body><a href="https://indeed.com/job/456">View Job</a></body></html>',
+         "https://indeed.com/job/456"),  # ボタンが無ければ最初の indeed リンク
+        ('<html><body><a href="https://example.com">Some link</a></body></html>', ""),
+    ])
+    def test_extract(self, html, expected):
+        assert extract_indeed_url(html) == expected
+
+    def test_application_button_wins_over_earlier_indeed_link(self):
+        html = (
+            '<a href="https://indeed.com/job/456">View Job</a>'
+            '<a href="https://indeed.com/apply/123"><span>応募内容を確認する</span></a>'
+        )
+        assert extract_indeed_url(html) == "https://indeed.com/apply/123"
+
+    def test_fallback_scan_does_not_use_html_parser(self):
+        html = (
+            "<a href='https://example.com/'>top</a>"
+            '<a class="x" href=https://indeed.com/job/7?a=1&amp;b=2>View Job</a>'
+        )
+        with patch("bs4.BeautifulSoup") as mock_soup:
+            assert extract_indeed_url(html) == "https://indeed.com/job/7?a=1&b=2"
+        mock_soup.assert_not_called()
+
+    def test_button_fast_path_skips_html_parser(self):
+        """ボタンの <a> が文字列走査で特定できれば BeautifulSoup を使わないこと"""
+        html = '<p>x</p><A class="btn" HREF="https://indeed.com/apply/1?a=1&amp;b=2"><b>応募内容を確認する</b></A>'
+        with patch("bs4.BeautifulSoup") as mock_soup:
+            assert extract_indeed_url(html) == "https://indeed.com/apply/1?a=1&b=2"
+        mock_soup.assert_not_called()
+
+    def test_unquoted_button_href_is_found_by_fast_path(self):
+        """高速経路も全 <a> 走査と同じく引用符なしの href を受け付けること"""
+        html = '<a href="https://indeed.com/job/1">View Job</a><a href=https://indeed.com/apply/2>応募内容を確認する</a>'
+        with patch("src.main._RE_ANCHOR") as mock_anchor:
+            assert extract_indeed_url(html) == "https://indeed.com/apply/2"
+        mock_anchor.finditer.assert_not_called()
+
+    @pytest.mark.parametrize("button", [
+        "応募内容を<br>確認する",
+        "<span>応募内容を</span><span>確認する</span>",
+        "応募内容を&#30906;認する",
+        "応募内容を<b>&#x78BA;認</b>する",
+    ])
+    def test_button_text_split_by_tags_or_entities(self, button):
+        """タグや文字参照で分かれたボタン文言でも、先に出てくる indeed リンクではなくボタンを選ぶこと"""
+        html = (
+            '<a href="https://indeed.com/job/456">View Job</a>'
+            f'<a href="https://indeed.com/apply/123">{button}</a>'
+        )
+        assert extract_indeed_url(html) == "https://indeed.com/apply/123"
+
+    def test_button_text_outside_anchor_falls_back_to_anchor_scan(self):
+        html = (
+            '<p>下の「応募内容を確認する」を押してください</p>'
+            '<a href="https://indeed.com/apply/9">応募内容を確認する</a>'
+        )
+        assert extract_indeed_url(html) == "https://indeed.com/apply/9"
+
+
+class TestMakeSoup:
+    def test_falls_back_to_html_parser_without_lxml(self):
+        import bs4
+        import src.main as main_module
+        real_soup = bs4.BeautifulSoup
+
+        def soup_without_lxml(html, parser):
+            if parser == "lxml":
+                raise bs4.FeatureNotFound("lxml")
+            return real_soup(html, parser)
+
+        with patch("src.main._SOUP_PARSER", "lxml"), \
+             patch("bs4.BeautifulSoup", side_effect=soup_without_lxml), \
+             patch("src.main.log"):
+            soup = main_module.make_soup('<a href="https://indeed.com/x">x</a>')
+            assert main_module._SOUP_PARSER == "html.parser"
+        assert soup.a["href"] == "https://indeed.com/x"
 
 
 class TestDetermineSource:
@@ -292,35 +402,272 @@ class TestProcessedIds:
             assert result == set()
             assert success == True  # First run is considered success
 
-    def test_save_and_load(self):
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            temp_path = f.name
-
-        try:
-            with patch('src.main.PROCESSED_IDS_FILE', temp_path):
-                ids = {"id1", "id2", "id3"}
-                save_result = save_processed_ids(ids)
-                assert save_result == True
+    @pytest.mark.parametrize("ids", [set(), {"x"}, {"id1", "id2", "id3"}])
+    def test_save_and_load(self, tmp_path, monkeypatch, ids):
+        monkeypatch.setattr('src.main.PROCESSED_IDS_FILE', str(tmp_path / "ids.json"))
+        assert save_processed_ids(ids) == True
+        loaded, success = load_processed_ids()
+        assert loaded == ids
+        assert success == True
+
+    def test_load_corrupted_file(self, tmp_path, monkeypatch):
+        path = tmp_path / "ids.json"
+        path.write_text("not valid json")
+        monkeypatch.setattr('src.main.PROCESSED_IDS_FILE', str(path))
+        with patch('src.main.log') as mock_log, patch('src.main.notify_error_to_slack'):
+            result, success = load_processed_ids()
+        assert result == set()
+        assert success == False  # Corrupted file returns False
+        mock_log.assert_called()
+
+
+class TestProcessedIdsJsonBackend:
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_roundtrip_with_and_without_orjson(self, tmp_path, use_orjson):
+        import src.main as main_module
+        if use_orjson and main_module.orjson is None:
+            pytest.skip("orjson is not installed")
+        path = str(tmp_path / "processed_ids.json")
+        backend = main_module.orjson if use_orjson else None
+        with patch('src.main.PROCESSED_IDS_FILE', path), \
+             patch('src.main.orjson', backend), \
+             patch('src.main.log'):
+            assert save_processed_ids({"gm:1", "mid:<テスト@example.com>"}) is True
+            loaded, success = load_processed_ids()
+        assert success is True
+        assert loaded == {"gm:1", "mid:<テスト@example.com>"}
+        # どちらのバックエンドでも標準 json で読める形式で保存される
+        assert sorted(json.loads((tmp_path / "processed_ids.json").read_text(encoding="utf-8"))) == [
+            "gm:1", "mid:<テスト@example.com>"]
+
+    def test_stdlib_fallback_writes_compact_json(self, tmp_path):
+        path = tmp_path / "processed_ids.json"
+        with patch('src.main.PROCESSED_IDS_FILE', str(path)), \
+             patch('src.main.orjson', None), \
+             patch('src.main.log'):
+            assert save_processed_ids({"gm:1", "gm:2"}) is True
+        raw = path.read_bytes()
+        assert b" " not in raw
+        assert sorted(json.loads(raw)) == ["gm:1", "gm:2"]
+
+    def test_empty_snapshot_is_treated_as_corrupted(self, tmp_path):
+        path = tmp_path / "processed_ids.json"
+        path.write_bytes(b"")
+        with patch('src.main.PROCESSED_IDS_FILE', str(path)), \
+             patch('src.main.notify_error_to_slack'), \
+             patch('src.main.log'):
+            loaded, success = load_processed_ids()
+        assert loaded == set()
+        assert success is False
+
+
+class TestProcessedIdsJournal:
+    def test_append_then_load_replays_journal(self, tmp_path):
+        path = str(tmp_path / "processed_ids.json")
+        with patch('src.main.PROCESSED_IDS_FILE', path), patch('src.main.log'):
+            assert save_processed_ids({"gm:1"}) is True
+            ids = {"gm:1", "gm:2", "uid:7"}
+            assert append_processed_ids(ids, ["gm:2", "uid:7"]) is True
+            # スナップショットは書き直されず、ジャーナルに追記される
+            assert list(json.loads((tmp_path / "processed_ids.json").read_text())) == ["gm:1"]
+            assert (tmp_path / "processed_ids.json.journal").read_text().split("\t")[0] == "gm:2"
+            loaded, success = load_processed_ids()
+        assert success is True
+        assert loaded == {"gm:1", "gm:2"}
+
+    def test_journal_path_does_not_clash_with_app_log(self, tmp_path):
+        """PROCESSED_IDS_FILE を LOG_DIR/recruit.json にしてもジャーナルが recruit.log にならない"""
+        with patch('src.main.PROCESSED_IDS_FILE', str(tmp_path / "recruit.json")):
+            journal_path = get_processed_ids_journal_path()
+        assert journal_path == tmp_path / "recruit.json.journal"
+        assert journal_path != tmp_path / "recruit.log"
+
+    def test_journal_only_is_loaded(self, tmp_path):
+        path = str(tmp_path / "processed_ids.json")
+        (tmp_path / "processed_ids.json.journal").write_text("gm:5\nmid:<a@b>\n")
+        with patch('src.main.PROCESSED_IDS_FILE', path), patch('src.main.log'):
+            loaded, success = load_processed_ids()
+        assert success is True
+        assert loaded == {"gm:5", "mid:<a@b>"}
+
+    def test_compaction_at_threshold(self, tmp_path):
+        path = str(tmp_path / "processed_ids.json")
+        with patch('src.main.PROCESSED_IDS_FILE', path), \
+             patch('src.main.PROCESSED_IDS_JOURNAL_COMPACT_THRESHOLD', 2), \
+             patch('src.main.log'):
+            assert save_processed_ids(set()) is True
+            ids = {"gm:1"}
+            assert append_processed_ids(ids, ["gm:1"]) is True
+            assert (tmp_path / "processed_ids.json.journal").exists()
+            ids.add("gm:2")
+            assert append_processed_ids(ids, ["gm:2"]) is True
+            # しきい値到達でスナップショットに畳み込まれ、ジャーナルは消える
+            assert not (tmp_path / "processed_ids.json.journal").exists()
+            assert sorted(json.loads((tmp_path / "processed_ids.json").read_text())) == ["gm:1", "gm:2"]
+
+    def test_compaction_after_interval(self, tmp_path):
+        path = str(tmp_path / "processed_ids.json")
+        with patch('src.main.PROCESSED_IDS_FILE', path), \
+             patch('src.main.PROCESSED_IDS_JOURNAL_COMPACT_SECONDS', 3600), \
+             patch('src.main.log'):
+            assert save_processed_ids(set()) is True
+            ids = {"gm:1"}
+            assert append_processed_ids(ids, ["gm:1"]) is True
+            assert (tmp_path / "processed_ids.json.journal").exists()
+            ids.add("gm:2")
+            # 件数はしきい値未満でも、前回のスナップショットから間隔が空いていれば畳み込む
+            with patch('src.main._last_snapshot_at', 0.0):
+                assert append_processed_ids(ids, ["gm:2"]) is True
+            assert not (tmp_path / "processed_ids.json.journal").exists()
+            assert sorted(json.loads((tmp_path / "processed_ids.json").read_text())) == ["gm:1", "gm:2"]
+
+
+class TestProcessedIdsRetention:
+    def test_snapshot_stores_added_time_and_evicts_expired(self, tmp_path):
+        import time as _time
+        from src.main import ProcessedIds
+        path = tmp_path / "processed_ids.json"
+        now = int(_time.time())
+        ids = ProcessedIds()
+        ids.add("gm:1", added_at=now - 30 * 86400)
+        ids.add("uid:9", added_at=now - 30 * 86400)
+        ids.add("gm:2", added_at=now - 60)
+        with patch('src.main.PROCESSED_IDS_FILE', str(path)), \
+             patch('src.main.PROCESSED_IDS_RETENTION_DAYS', 14), \
+             patch('src.main.log'):
+            assert save_processed_ids(ids) is True
+        assert json.loads(path.read_text()) == {"gm:2": now - 60}
+        assert ids == {"gm:2"}  # メモリ上からも期限切れ（uid: 含む）を捨てる
+
+    def test_legacy_list_snapshot_and_journal_are_loaded(self, tmp_path):
+        path = tmp_path / "processed_ids.json"
+        path.write_text(json.dumps(["gm:1", "12345"]))
+        (tmp_path / "processed_ids.json.journal").write_text("gm:2\n")
+        with patch('src.main.PROCESSED_IDS_FILE', str(path)), patch('src.main.log'):
+            loaded, success = load_processed_ids()
+            assert success is True
+            assert loaded == {"gm:1", "gm:12345", "gm:2"}
+            # 移行時の保存で追加時刻付きの形式に書き直される
+            assert set(json.loads(path.read_text())) == {"gm:1", "gm:12345", "gm:2"}
+
+    def test_expired_entries_are_dropped_on_load(self, tmp_path):
+        import time as _time
+        path = tmp_path / "processed_ids.json"
+        now = int(_time.time())
+        path.write_text(json.dumps({"gm:1": now - 30 * 86400, "gm:2": now}))
+        (tmp_path / "processed_ids.json.journal").write_text(f"gm:3\t{now - 30 * 86400}\ngm:4\t{now}\n")
+        with patch('src.main.PROCESSED_IDS_FILE', str(path)), \
+             patch('src.main.PROCESSED_IDS_RETENTION_DAYS', 14), \
+             patch('src.main.log'):
+            loaded, success = load_processed_ids()
+        assert success is True
+        assert loaded == {"gm:2", "gm:4"}
+
+
+class TestProcessedIdsContainer:
+    """ProcessedIds（gm:/uid: を int で持つ集合）のテスト"""
+
+    def test_behaves_like_string_set(self):
+        from src.main import ProcessedIds
+        ids = ProcessedIds(["gm:123", "uid:45", "mid:<a@b>", "unclf:gm:9"])
+        assert ids == {"gm:123", "uid:45", "mid:<a@b>", "unclf:gm:9"}
+        assert len(ids) == 4
+        assert "gm:123" in ids and "uid:45" in ids and "mid:<a@b>" in ids
+        assert "gm:124" not in ids and "uid:123" not in ids
+        assert None not in ids
+
+    def test_numeric_ids_are_stored_as_ints(self):
+        from src.main import ProcessedIds
+        ids = ProcessedIds()
+        ids.add("gm:18000000000000000000")
+        ids.add("uid:7")
+        assert {prefix: set(keys) for prefix, keys in ids._ints.items()} == {
+            "gm:": {18000000000000000000}, "uid:": {7}}
+        assert not ids._strs
+
+    def test_non_canonical_digits_stay_strings(self):
+        """先頭ゼロ付きなど int にすると戻せないIDは文字列のまま往復すること"""
+        from src.main import ProcessedIds
+        ids = ProcessedIds(["gm:007", "gm:abc"])
+        assert set(ids) == {"gm:007", "gm:abc"}
+        assert "gm:7" not in ids
+
+    def test_discard(self):
+        from src.main import ProcessedIds
+        ids = ProcessedIds(["gm:1", "mid:<x>"])
+        ids.discard("gm:1")
+        ids.discard("mid:<x>")
+        ids.discard("gm:2")
+        assert len(ids) == 0
+
+    def test_evict_older_than(self):
+        from src.main import ProcessedIds
+        ids = ProcessedIds()
+        ids.add("gm:1", added_at=100)
+        ids.add("mid:<old>", added_at=100)
+        ids.add("gm:2", added_at=300)
+        ids.add("gm:1", added_at=400)  # 既存IDの時刻は更新しない
+        assert ids.added_at("gm:1") == 100
+        assert ids.evict_older_than(200) == 2
+        assert ids == {"gm:2"}
+
+    def test_load_returns_processed_ids(self):
+        from src.main import ProcessedIds
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "ids.json")
+            with open(path, "w") as f:
+                json.dump(["gm:1", "mid:<x>"], f)
+            with patch("src.main.PROCESSED_IDS_FILE", path):
                 loaded, success = load_processed_ids()
-                assert loaded == ids
-                assert success == True
-        finally:
-            os.unlink(temp_path)
-
-    def test_load_corrupted_file(self):
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            f.write("not valid json")
-            temp_path = f.name
-
+        assert success
+        assert isinstance(loaded, ProcessedIds)
+        assert loaded == {"gm:1", "mid:<x>"}
+
+
+class TestLogging:
+    def test_log_uses_rotating_file_and_stdout_handlers(self):
+        import logging
+        from logging.handlers import QueueHandler, RotatingFileHandler
+        from src.main import _logger, _log_listener, LOG_MAX_BYTES
+        # 呼び出し側はキューに積むだけで、実際の書き込みはリスナーのスレッドが行う
+        assert any(isinstance(h, QueueHandler) for h in _logger.handlers)
+        file_handlers = [h for h in _log_listener.handlers if isinstance(h, RotatingFileHandler)]
+        assert len(file_handlers) == 1
+        assert file_handlers[0].maxBytes == LOG_MAX_BYTES
+        assert file_handlers[0].baseFilename.endswith("recruit.log")
+        assert any(type(h) is logging.StreamHandler for h in _log_listener.handlers)
+
+    def test_import_does_not_start_listener_thread(self):
+        """import だけではリスナーのスレッドを起動せず、最初の log() で起動すること"""
+        import subprocess
+        code = (
+            "import threading, src.main as m\n"
+            "before = threading.active_count()\n"
+            "m.log('hello')\n"
+            "print(before, threading.active_count())\n"
+        )
+        root = os.path.join(os.path.dirname(__file__), "..")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(os.environ, LOG_DIR=tmpdir)
+            result = subprocess.run([sys.executable, "-c", code], cwd=root, env=env,
+                                    capture_output=True, text=True, check=True)
+        assert "1 2" in result.stdout.splitlines()
+
+    def test_log_emits_utc_timestamped_line(self):
+        import logging
+        from src.main import _logger, _log_listener, log
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        handler.setFormatter(_log_listener.handlers[0].formatter)
+        _logger.addHandler(handler)
         try:
-            with patch('src.main.PROCESSED_IDS_FILE', temp_path):
-                with patch('src.main.log') as mock_log:
-                    result, success = load_processed_ids()
-                    assert result == set()
-                    assert success == False  # Corrupted file returns False
-                    mock_log.assert_called()
+            log("hello")
         finally:
-            os.unlink(temp_path)
+            _logger.removeHandler(handler)
+        line = handler.format(records[0])
+        assert line.endswith(" hello")
+        assert len(line.split(" ")[0]) == 10  # YYYY-MM-DD
 
 
 class TestEnsureProcessedIdsDir:
@@ -450,11 +797,9 @@ class TestModeManagement:
 class TestExtractHtmlEdgeCases:
     def test_none_payload(self):
         """Test handling when get_payload returns None - should return empty string"""
-        msg = MagicMock()
-        msg.is_multipart.return_value = False
-        msg.get_content_type.return_value = "text/html"
-        msg.get_content_charset.return_value = "utf-8"
-        msg.get_payload.return_value = None
+        msg = email.message.Message()
+        msg["Content-Type"] = "text/html; charset=utf-8"
+        msg.set_payload(None)
 
         # After bug fix, this should return empty string instead of raising AttributeError
         result = extract_html(msg)
@@ -478,7 +823,8 @@ class TestNotifySlackWithRetry:
         
         assert result == True
         assert mock_post.call_count == 2
-        mock_sleep.assert_called_once_with(1)  # 2^0 = 1 second backoff
+        mock_sleep.assert_called_once()
+        assert 1 <= mock_sleep.call_args.args[0] <= 1.5  # 2^0 = 1 second backoff + up to 50% jitter
 
     @patch('src.main.time.sleep')
     @patch('src.main._http_session.post')
@@ -514,6 +860,108 @@ class TestNotifySlackWithRetry:
         assert mock_post.call_count == 2
 
 
+class TestNotifyRetryBackoff:
+    def test_delay_grows_exponentially_with_bounded_jitter(self):
+        from src.main import notify_retry_delay
+        for attempt, base in [(0, 1), (1, 2), (2, 4)]:
+            for _ in range(20):
+                assert base <= notify_retry_delay(attempt) <= base * 1.5
+
+    def test_delay_is_capped(self):
+        from src.main import notify_retry_delay, NOTIFY_RETRY_CAP_SECONDS
+        assert notify_retry_delay(20) <= NOTIFY_RETRY_CAP_SECONDS * 1.5
+
+    def test_retry_after_seconds_is_honoured(self):
+        from src.main import notify_retry_delay
+        resp = MagicMock(status_code=429, headers={"Retry-After": "7"})
+        assert notify_retry_delay(0, resp) == 7
+        resp = MagicMock(status_code=429, headers={"Retry-After": "3600"})
+        assert notify_retry_delay(0, resp) == 30
+
+    def test_retry_after_http_date(self):
+        from src.main import retry_after_seconds
+        resp = MagicMock(headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        assert retry_after_seconds(resp) == 0.0
+        assert retry_after_seconds(MagicMock(headers={"Retry-After": "soon"})) is None
+
+    @patch('src.main.time.sleep')
+    @patch('src.main._http_session.post')
+    @patch('src.main.get_slack_webhook_url', return_value="https://hooks.slack.com/test")
+    @patch('src.main.notify_error_to_slack')
+    def test_slack_non_retryable_4xx_is_not_retried(self, mock_error, mock_get_url, mock_post, mock_sleep):
+        mock_post.return_value = MagicMock(status_code=404, text="no_service")
+        assert notify_slack_with_retry("indeed", "山田太郎", "") is False
+        assert mock_post.call_count == 1
+        mock_sleep.assert_not_called()
+        mock_error.assert_called_once()
+
+    @patch('src.main.time.sleep')
+    @patch('src.main._http_session.post')
+    @patch('src.main.get_slack_webhook_url', return_value="https://hooks.slack.com/test")
+    def test_slack_429_waits_retry_after(self, mock_get_url, mock_post, mock_sleep):
+        mock_post.side_effect = [
+            MagicMock(status_code=429, text="rate_limited", headers={"Retry-After": "5"}),
+            MagicMock(status_code=200),
+        ]
+        assert notify_slack_with_retry("indeed", "山田太郎", "") is True
+        mock_sleep.assert_called_once_with(5.0)
+
+    @patch('src.main.time.sleep')
+    @patch('src.main._http_session.post')
+    @patch('src.main.SLACK_ERROR_WEBHOOK_URL', "https://hooks.slack.com/err")
+    @patch('src.main.SLACK_DM_WEBHOOK_URL', None)
+    def test_error_notification_is_sent_once_without_backoff(self, mock_post, mock_sleep):
+        """エラー通知は呼び出し元（通知スレッド・IMAP サイクル）を待たせないよう1回だけ送ること"""
+        from src.main import notify_error_to_slack
+        mock_post.side_effect = [MagicMock(status_code=503, headers={}), MagicMock(status_code=200)]
+        notify_error_to_slack("boom", dedup_key="test_retry_transient", dedup_seconds=0)
+        assert mock_post.call_count == 1
+        mock_sleep.assert_not_called()
+
+
+class TestErrorNotificationDedup:
+    @patch('src.main.SLACK_ERROR_WEBHOOK_URL', "https://hooks.slack.com/err")
+    @patch('src.main.SLACK_DM_WEBHOOK_URL', None)
+    def test_concurrent_calls_with_same_key_send_once(self):
+        """Slack/LINE の通知スレッドから同時に同じエラーを通知しても1回だけ送ること"""
+        import threading
+        from src.main import notify_error_to_slack
+        barrier = threading.Barrier(8, timeout=5)
+
+        def call():
+            barrier.wait()
+            notify_error_to_slack("boom", dedup_key="test_concurrent_dedup")
+
+        with patch('src.main._http_session.post', return_value=MagicMock(status_code=200)) as mock_post, \
+             patch('src.main.log'):
+            threads = [threading.Thread(target=call) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(timeout=5)
+        assert mock_post.call_count == 1
+
+
+class TestNotifyAllChannels:
+    def test_slack_and_line_are_sent_concurrently(self):
+        """Slack と LINE の送信が並行に走ること（片方の完了を待たずにもう片方が始まる）"""
+        import threading
+        from src.main import notify_all_channels
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_for_other(result):
+            def send(*args, **kwargs):
+                barrier.wait()  # 逐次実行なら相手が来ずに BrokenBarrierError になる
+                return result
+            return send
+
+        with patch("src.main.notify_slack_with_retry", side_effect=wait_for_other(True)) as mock_slack, \
+             patch("src.main.notify_line_with_retry", side_effect=wait_for_other(False)) as mock_line:
+            assert notify_all_channels("indeed", "山田太郎", "https://x", job_title="警備員") == (True, False)
+        mock_slack.assert_called_once_with("indeed", "山田太郎", "https://x", job_title="警備員")
+        mock_line.assert_called_once_with("indeed", "山田太郎", "https://x", job_title="警備員")
+
+
 class TestNotifyLineWithRetry:
     @patch('src.main.time.sleep')
     @patch('src.main._http_session.post')
@@ -532,7 +980,8 @@ class TestNotifyLineWithRetry:
         
         assert result == True
         assert mock_post.call_count == 2
-        mock_sleep.assert_called_once_with(1)  # 2^0 = 1 second backoff
+        mock_sleep.assert_called_once()
+        assert 1 <= mock_sleep.call_args.args[0] <= 1.5  # 2^0 = 1 second backoff + up to 50% jitter
 
     @patch('src.main.time.sleep')
     @patch('src.main._http_session.post')
@@ -905,6 +1354,22 @@ class TestIMAPConnectionPool:
         mock_cls.assert_not_called()
         alive.noop.assert_called_once()
 
+    def test_skips_noop_right_after_successful_use(self):
+        """直前に正常終了した接続は NOOP なしでそのまま再利用すること。"""
+        pool = self._make_pool()
+        alive = MagicMock()
+        pool._connection = alive
+        pool.mark_ok()
+
+        assert pool.get() is alive
+        alive.noop.assert_not_called()
+
+        # 時間が空いたら従来どおり NOOP で生存確認する
+        alive.noop.return_value = ("OK", [b"NOOP completed."])
+        with patch("src.main.IMAP_NOOP_SKIP_SECONDS", 0):
+            assert pool.get() is alive
+        alive.noop.assert_called_once()
+
     def test_reconnects_when_noop_fails(self):
         import imaplib as _imaplib
         pool = self._make_pool()
@@ -913,6 +1378,8 @@ class TestIMAPConnectionPool:
         pool._connection = dead
 
         fresh = MagicMock()
+        # SELECT の応答として imaplib が溜める EXISTS（総数）は新着扱いしないよう捨てること
+        fresh.untagged_responses = {"EXISTS": [b"120"], "UIDVALIDITY": [b"7"]}
         with patch("src.main.imaplib.IMAP4_SSL", return_value=fresh) as mock_cls, \
              patch("src.main.GMAIL_IMAP_USER", "u"), \
              patch("src.main.GMAIL_IMAP_PASSWORD", "p"):
@@ -922,6 +1389,7 @@ class TestIMAPConnectionPool:
         mock_cls.assert_called_once()
         fresh.login.assert_called_once_with("u", "p")
         fresh.select.assert_called_once_with("INBOX", readonly=True)
+        assert fresh.untagged_responses == {"UIDVALIDITY": [b"7"]}
         # Dead connection should be closed during reconnect.
         dead.close.assert_called_once()
         dead.logout.assert_called_once()
@@ -991,6 +1459,144 @@ class TestIMAPConnectionPool:
             _imap_pool._connection = None
 
 
+class TestImapIdle:
+    """IMAP IDLE 待機（imap_idle / wait_for_new_mail）のテスト"""
+
+    def _make_mail(self, lines):
+        mail = MagicMock()
+        mail.untagged_responses = {}
+        mail.tagged_commands = {}
+        mail._new_tag.return_value = b"A001"
+        mail.readline.side_effect = lines
+        return mail
+
+    def test_exists_sends_done_and_returns_true(self):
+        from src.main import imap_idle
+        mail = self._make_mail([
+            b"+ idling\r\n",
+            b"* 3 FETCH (FLAGS (\\Seen))\r\n",
+            b"* 12 EXISTS\r\n",
+            b"A001 OK IDLE terminated\r\n",
+        ])
+        assert imap_idle(mail, 60) is True
+        assert [c.args[0] for c in mail.send.call_args_list] == [b"A001 IDLE\r\n", b"DONE\r\n"]
+
+    def test_timeout_returns_false(self):
+        from src.main import imap_idle
+        mail = self._make_mail([
+            b"+ idling\r\n",
+            b"A001 OK IDLE terminated\r\n",
+        ])
+        with patch("src.main._wait_imap_readable", return_value=False):
+            assert imap_idle(mail, 60) is False
+        assert mail.send.call_args_list[-1].args[0] == b"DONE\r\n"
+
+    def _socketpair_mail(self, server_script):
+        """socketpair の片側を IMAP 接続に見立て、もう片側で server_script（受信待ち行→送信内容）を再生する。"""
+        import socket as _socket
+        import threading
+        client, server = _socket.socketpair()
+        mail = MagicMock()
+        mail.untagged_responses = {}
+        mail.tagged_commands = {}
+        mail._new_tag.return_value = b"A001"
+        mail.sock = client
+        mail.file = client.makefile("rb")
+        mail.readline.side_effect = lambda: mail.file.readline()
+        mail.send.side_effect = client.sendall
+
+        def serve():
+            reader = server.makefile("rb")
+            for expected, reply in server_script:
+                assert reader.readline() == expected
+                server.sendall(reply)
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        return mail, client, server, thread
+
+    def test_timeout_keeps_real_socket_readable(self):
+        """IDLE が時間切れになっても、DONE 後のタグ付き OK を同じストリームから読める"""
+        from src.main import imap_idle
+        mail, client, server, thread = self._socketpair_mail([
+            (b"A001 IDLE\r\n", b"+ idling\r\n"),
+            (b"DONE\r\n", b"A001 OK IDLE terminated\r\n"),
+        ])
+        try:
+            with patch("src.main._enable_tcp_keepalive"):
+                assert imap_idle(mail, 0.2) is False
+            thread.join(timeout=5)
+            assert not thread.is_alive()
+        finally:
+            mail.file.close()
+            client.close()
+            server.close()
+
+    def test_buffered_exists_is_seen_on_real_socket(self):
+        """継続応答と同じパケットで届いた EXISTS（読み込み済みバッファ内）を select 待ちで見逃さない"""
+        import time as _time
+        from src.main import imap_idle
+        mail, client, server, thread = self._socketpair_mail([
+            (b"A001 IDLE\r\n", b"+ idling\r\n* 12 EXISTS\r\n"),
+            (b"DONE\r\n", b"A001 OK IDLE terminated\r\n"),
+        ])
+        try:
+            with patch("src.main._enable_tcp_keepalive"):
+                started = _time.monotonic()
+                assert imap_idle(mail, 30) is True
+                assert _time.monotonic() - started < 5
+            thread.join(timeout=5)
+        finally:
+            mail.file.close()
+            client.close()
+            server.close()
+
+    def test_pending_exists_returns_without_idle(self):
+        """直前のコマンドで届いた EXISTS は IDLE に入らずすぐ新着扱いにする"""
+        from src.main import imap_idle
+        mail = self._make_mail([])
+        mail.untagged_responses = {"EXISTS": [b"12"]}
+        assert imap_idle(mail, 60) is True
+        mail.send.assert_not_called()
+
+    def test_rejected_idle_raises(self):
+        from src.main import imap_idle
+        mail = self._make_mail([b"A001 BAD unknown command\r\n"])
+        with pytest.raises(imaplib.IMAP4.error):
+            imap_idle(mail, 60)
+
+    def test_wait_falls_back_without_idle_capability(self):
+        from src.main import wait_for_new_mail, _imap_pool
+        live = MagicMock()
+        live.noop.return_value = ("OK", [b"NOOP completed."])
+        live.capabilities = ("IMAP4REV1",)
+        _imap_pool._connection = live
+        try:
+            assert wait_for_new_mail(60) is False
+        finally:
+            _imap_pool._connection = None
+
+    def test_wait_falls_back_without_pooled_connection(self):
+        from src.main import wait_for_new_mail, _imap_pool
+        _imap_pool._connection = None
+        with patch.object(_imap_pool, "get") as mock_get:
+            assert wait_for_new_mail(60) is False
+        mock_get.assert_not_called()
+
+    def test_wait_failure_resets_pool_and_falls_back(self):
+        from src.main import wait_for_new_mail, _imap_pool
+        live = MagicMock()
+        live.noop.return_value = ("OK", [b"NOOP completed."])
+        live.capabilities = ("IMAP4REV1", "IDLE")
+        _imap_pool._connection = live
+        try:
+            with patch("src.main.imap_idle", side_effect=imaplib.IMAP4.abort("eof")):
+                assert wait_for_new_mail(60) is False
+            assert _imap_pool._connection is None
+        finally:
+            _imap_pool._connection = None
+
+
 class TestExtractJobTitleFromSubject:
     def test_typical_indeed_subject(self):
         subject = "新しい応募者のお知らせ: 警備員 | 日本交通誘導警備株式会社"
@@ -1597,6 +2203,15 @@ class TestCheckMailAttemptDedup:
     注入する形でテストする。
     """
 
+    def setup_method(self):
+        # サイクル間で持ち越すモジュール状態（ブートストラップ済みフラグ・UID の基準点）をリセット
+        import src.main
+        src.main._bootstrap_done = False
+        src.main._clean_uid = None
+
+    def teardown_method(self):
+        self.setup_method()
+
     def _make_imap_mock(self, uid_list, gm_msgid_map=None):
         """uid_list を返す IMAP モックを作成する。
 
@@ -1617,12 +2232,19 @@ class TestCheckMailAttemptDedup:
             if cmd == "search":
                 return ("OK", [uid_bytes])
             elif cmd == "fetch":
-                # get_gm_msgid_lightweight 用の軽量フェッチ
-                uid_str = args[0].decode() if isinstance(args[0], bytes) else args[0]
-                uid_int = int(uid_str)
-                gm_id = gm_msgid_map.get(uid_int, uid_int * 1000)
-                header = f"{uid_int} (X-GM-MSGID {gm_id})".encode()
-                return ("OK", [(header, b"")])
+                # fetch_gm_msgids_batch / fetch_bodies_batch 用のバッチフェッチ（UID はカンマ区切り）
+                uid_set = args[0].decode() if isinstance(args[0], bytes) else args[0]
+                with_body = "BODY.PEEK[" in args[1]
+                lines = []
+                for seq, uid_str in enumerate(uid_set.split(","), start=1):
+                    uid_int = int(uid_str)
+                    gm_id = gm_msgid_map.get(uid_int, uid_int * 1000)
+                    if with_body:
+                        header = f"{seq} (X-GM-MSGID {gm_id} UID {uid_int} BODY[] {{4}}".encode()
+                        lines.extend([(header, b"body"), b")"])
+                    else:
+                        lines.append(f"{seq} (X-GM-MSGID {gm_id} UID {uid_int})".encode())
+                return ("OK", lines)
             return ("NO", [b""])
 
         mail.uid.side_effect = fake_uid
@@ -1640,7 +2262,7 @@ class TestCheckMailAttemptDedup:
             yield mail
 
         with patch("src.main.imap_connection", mock_imap_connection), \
-             patch("src.main.process_mail_by_uid") as mock_process:
+             patch("src.main.process_parsed_mail") as mock_process:
             _check_mail_attempt(set())
 
         mock_process.assert_not_called()
@@ -1658,7 +2280,7 @@ class TestCheckMailAttemptDedup:
             yield mail
 
         with patch("src.main.imap_connection", mock_imap_connection), \
-             patch("src.main.process_mail_by_uid") as mock_process:
+             patch("src.main.process_parsed_mail") as mock_process:
             _check_mail_attempt(processed)
 
         # uid: キャッシュがあるのでフル処理は不要
@@ -1679,12 +2301,15 @@ class TestCheckMailAttemptDedup:
             yield mail
 
         with patch("src.main.imap_connection", mock_imap_connection), \
-             patch("src.main.process_mail_by_uid") as mock_process, \
-             patch("src.main.save_processed_ids", return_value=True):
+             patch("src.main.process_parsed_mail") as mock_process, \
+             patch("src.main.save_processed_ids", return_value=True) as mock_save:
             _check_mail_attempt(processed)
 
         # gm: dedup が効いてフル処理は呼ばれない
         mock_process.assert_not_called()
+        # 補完した uid: は永続化しないのでスナップショットも書き直さない
+        assert "uid:200" in processed
+        mock_save.assert_not_called()
 
     def test_new_uid_triggers_full_processing(self):
         """未処理の UID は process_mail_by_uid が呼ばれること。"""
@@ -1698,8 +2323,443 @@ class TestCheckMailAttemptDedup:
             yield mail
 
         with patch("src.main.imap_connection", mock_imap_connection), \
-             patch("src.main.process_mail_by_uid", return_value="gm:888001") as mock_process, \
+             patch("src.main.process_parsed_mail", return_value="gm:888001") as mock_process, \
+             patch("src.main.append_processed_ids", return_value=True) as mock_append:
+            _check_mail_attempt(set())
+
+        mock_process.assert_called_once()
+        assert mock_process.call_args.args[:3] == ("300", "888001", b"body")
+        # 新規IDはジャーナル追記で永続化される（全件書き直しではない）
+        assert mock_append.call_args.args[1] == ["gm:888001"]
+
+    def test_gm_msgid_probe_is_single_batched_fetch(self):
+        """Phase 2 の X-GM-MSGID 取得は UID ごとではなく1回のバッチ FETCH で行うこと。"""
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+
+        mail = self._make_imap_mock([400, 401, 402], gm_msgid_map={400: 1, 401: 2, 402: 3})
+        processed = {"gm:1", "gm:2", "gm:3"}
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
+
+        with patch("src.main.imap_connection", mock_imap_connection), \
+             patch("src.main.process_parsed_mail") as mock_process, \
              patch("src.main.save_processed_ids", return_value=True):
+            _check_mail_attempt(processed)
+
+        fetch_calls = [c for c in mail.uid.call_args_list if c.args[0] == "fetch"]
+        assert len(fetch_calls) == 1
+        assert fetch_calls[0].args[1] == "400,401,402"
+        mock_process.assert_not_called()
+        assert {"uid:400", "uid:401", "uid:402"} <= processed
+
+    def _run_cycle(self, mail, processed):
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
+
+        with patch("src.main.imap_connection", mock_imap_connection), \
+             patch("src.main.process_parsed_mail", return_value=None) as mock_process, \
+             patch("src.main.append_processed_ids", return_value=True):
+            _check_mail_attempt(processed)
+        return mock_process
+
+    def _search_calls(self, mail):
+        return [c.args for c in mail.uid.call_args_list if c.args[0] == "search"]
+
+    def test_search_is_narrowed_to_uids_after_clean_cycle(self):
+        """clean なサイクルの後は UID 最大値より後だけを SEARCH すること。"""
+        mail = self._make_imap_mock([300], gm_msgid_map={300: 1})
+        mail.untagged_responses = {"UIDVALIDITY": [b"7"]}
+        processed = {"gm:1"}
+        self._run_cycle(mail, processed)
+        assert "UID" not in self._search_calls(mail)[0]
+
+        # 2サイクル目: "301:*" でも Gmail は最大 UID(300) を返すが、処理対象にはしない
+        mail.uid.reset_mock()
+        mock_process = self._run_cycle(mail, processed)
+        assert self._search_calls(mail)[0][2:4] == ("UID", "301:*")
+        mock_process.assert_not_called()
+
+    def test_uid_watermark_not_advanced_when_cycle_is_not_clean(self):
+        """通知失敗などで拾い直すメールが残る間は UID で絞らないこと。"""
+        mail = self._make_imap_mock([300])
+        mail.untagged_responses = {"UIDVALIDITY": [b"7"]}
+        self._run_cycle(mail, set())  # process_parsed_mail が None → clean ではない
+        mail.uid.reset_mock()
+        mock_process = self._run_cycle(mail, set())
+        assert "UID" not in self._search_calls(mail)[0]
+        mock_process.assert_called_once()
+
+    def test_uid_watermark_ignored_after_uidvalidity_change(self):
+        mail = self._make_imap_mock([300], gm_msgid_map={300: 1})
+        mail.untagged_responses = {"UIDVALIDITY": [b"7"]}
+        processed = {"gm:1"}
+        self._run_cycle(mail, processed)
+        mail.untagged_responses = {"UIDVALIDITY": [b"8"]}
+        mail.uid.reset_mock()
+        self._run_cycle(mail, processed)
+        assert "UID" not in self._search_calls(mail)[0]
+
+    def _run_with_result(self, mail, processed, process_result=None):
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+
+        mail.untagged_responses = {"UIDVALIDITY": [b"7"]}
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
+
+        with patch("src.main.imap_connection", mock_imap_connection), \
+             patch("src.main.process_parsed_mail", return_value=process_result) as mock_process, \
+             patch("src.main.append_processed_ids", return_value=True):
+            _check_mail_attempt(processed)
+        return mock_process
+
+    def test_exists_seen_before_search_is_discarded(self):
+        """サイクル開始前に届いた EXISTS は SEARCH で拾うので、続く IDLE の新着扱いに残さないこと。"""
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+        mail = self._make_imap_mock([])
+        mail.untagged_responses = {"EXISTS": [b"12"]}
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
+
+        with patch("src.main.imap_connection", mock_imap_connection):
             _check_mail_attempt(set())
+        assert "EXISTS" not in mail.untagged_responses
+
+    def test_failed_notification_reports_unclean_cycle(self):
+        """通知失敗で拾い直すメールが残るサイクルは False、全件処理できたサイクルは True を返すこと。"""
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+        mail = self._make_imap_mock([600], gm_msgid_map={600: 6})
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
 
+        with patch("src.main.imap_connection", mock_imap_connection), \
+             patch("src.main.append_processed_ids", return_value=True):
+            with patch("src.main.process_parsed_mail", return_value=None):
+                assert _check_mail_attempt(set()) is False
+            with patch("src.main.process_parsed_mail", return_value="gm:6"):
+                assert _check_mail_attempt(set()) is True
+
+    def test_unfinished_cycle_keeps_searching(self):
+        """拾い直すメール（通知失敗・未分類）が残るサイクルの後は UID の基準点を進めず、同じメールを再処理すること。"""
+        mail = self._make_imap_mock([600], gm_msgid_map={600: 6})
+        processed = set()
+        self._run_with_result(mail, processed, process_result=None)
+        mock_process = self._run_with_result(mail, processed, process_result=None)
         mock_process.assert_called_once()
+
+    def test_phase2_probe_skipped_after_bootstrap(self):
+        """ブートストラップ後は Phase 1 を通過した UID を X-GM-MSGID 照会せず直接本文取得すること。"""
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+
+        mail = self._make_imap_mock([700], gm_msgid_map={700: 7})
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
+
+        with patch("src.main.imap_connection", mock_imap_connection), \
+             patch("src.main.process_parsed_mail", return_value="gm:7"), \
+             patch("src.main.append_processed_ids", return_value=True), \
+             patch("src.main._bootstrap_done", True):
+            processed = set()
+            _check_mail_attempt(processed)
+
+        fetch_calls = [c for c in mail.uid.call_args_list if c.args[0] == "fetch"]
+        assert "(X-GM-MSGID)" not in [c.args[2] for c in fetch_calls]
+        assert {"gm:7", "uid:700"} <= processed
+
+    def test_already_processed_in_phase3_caches_uid(self):
+        """Phase 3 の二重チェックで処理済みと分かったメールは uid: を補完し、再保存しないこと。"""
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+
+        mail = self._make_imap_mock([800], gm_msgid_map={800: 8})
+        processed = {"gm:8"}
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
+
+        with patch("src.main.imap_connection", mock_imap_connection), \
+             patch("src.main.process_parsed_mail", return_value="gm:8"), \
+             patch("src.main.append_processed_ids", return_value=True) as mock_append, \
+             patch("src.main._bootstrap_done", True):
+            _check_mail_attempt(processed)
+
+        assert "uid:800" in processed
+        mock_append.assert_not_called()
+
+    def test_body_fetched_only_for_mail_that_needs_it(self):
+        """ヘッダだけ先に取得し、本文 FETCH は Indeed 応募通知の UID に限ること。"""
+        from src.main import _check_mail_attempt
+        from contextlib import contextmanager
+
+        headers = {
+            900: "Subject: =?utf-8?b?5paw44GX44GE5b+c5Yuf6ICF44Gu44GK55+l44KJ44Gb?=\r\nFrom: Indeed <noreply@indeed.com>\r\n\r\n",
+            901: "Subject: weekly newsletter\r\nFrom: news@example.com\r\n\r\n",
+        }
+        mail = MagicMock()
+
+        def fake_uid(cmd, *args):
+            if cmd == "search":
+                return ("OK", [b"900 901"])
+            lines = []
+            for seq, uid_str in enumerate(args[0].split(","), start=1):
+                uid_int = int(uid_str)
+                data = headers[uid_int].encode()
+                if "HEADER.FIELDS" not in args[1]:
+                    data += b"<html>body</html>"
+                lines.extend([(f"{seq} (X-GM-MSGID {uid_int} UID {uid_int} BODY[] {{{len(data)}}}".encode(), data), b")"])
+            return ("OK", lines)
+
+        mail.uid.side_effect = fake_uid
+
+        @contextmanager
+        def mock_imap_connection():
+            yield mail
+
+        with patch("src.main.imap_connection", mock_imap_connection), \
+             patch("src.main.process_parsed_mail", side_effect=lambda uid, gm, data, ids: f"gm:{gm}") as mock_process, \
+             patch("src.main.append_processed_ids", return_value=True), \
+             patch("src.main._bootstrap_done", True):
+            _check_mail_attempt(set())
+
+        fetch_calls = [c.args[1:] for c in mail.uid.call_args_list if c.args[0] == "fetch"]
+        assert fetch_calls == [
+            ("900,901", "(X-GM-MSGID BODY.PEEK[HEADER.FIELDS (SUBJECT FROM MESSAGE-ID DATE)])"),
+            ("900", "(X-GM-MSGID BODY.PEEK[])"),
+        ]
+        data_by_uid = {c.args[0]: c.args[2] for c in mock_process.call_args_list}
+        assert data_by_uid["900"].endswith(b"<html>body</html>")
+        assert not data_by_uid["901"].endswith(b"<html>body</html>")
+
+
+class TestMailNeedsBody:
+    def _headers(self, subject, sender, message_id="<m@x>"):
+        from email.header import Header
+        encoded = Header(subject, "utf-8").encode()
+        return f"Subject: {encoded}\r\nFrom: {sender}\r\nMessage-ID: {message_id}\r\n\r\n".encode("ascii")
+
+    def test_indeed_application_needs_body(self):
+        from src.main import mail_needs_body
+        assert mail_needs_body("1", self._headers("新しい応募者のお知らせ", "Indeed <noreply@indeed.com>"), set())
+
+    def test_jimoty_and_non_target_do_not(self):
+        from src.main import mail_needs_body
+        assert not mail_needs_body("1", self._headers("ジモティーからのお知らせ", "info@jmty.jp"), set())
+        assert not mail_needs_body("1", self._headers("hello", "a@example.com"), set())
+
+    def test_known_non_application_indeed_does_not(self):
+        from src.main import mail_needs_body, INDEED_NON_APPLICATION_PATTERNS
+        subject = INDEED_NON_APPLICATION_PATTERNS[0]
+        assert not mail_needs_body("1", self._headers(subject, "Indeed <noreply@indeed.com>"), set())
+
+    def test_unclassified_indeed_needs_body_until_notified(self):
+        from src.main import mail_needs_body
+        headers = self._headers("Indeed からの謎の件名", "Indeed <noreply@indeed.com>")
+        assert mail_needs_body("5", headers, set())
+        with patch("src.main._unclassified_normal_notified", {"gm:5"}):
+            assert not mail_needs_body("5", headers, set())
+
+    def test_already_processed_does_not(self):
+        from src.main import mail_needs_body
+        headers = self._headers("新しい応募者のお知らせ", "Indeed <noreply@indeed.com>")
+        assert not mail_needs_body("1", headers, {"gm:1"})
+
+    def test_jimoty_is_processed_without_full_mime_parse(self):
+        from src.main import process_parsed_mail
+        headers = self._headers("ジモティーからのお知らせ", "Yamada <info@jmty.jp>")
+        with patch("src.main.email.message_from_bytes") as mock_full_parse, \
+             patch("src.main.notify_all_channels", return_value=(True, True)) as mock_notify, \
+             patch("src.main.log"):
+            assert process_parsed_mail("1", "7", headers, set()) == "gm:7"
+        mock_full_parse.assert_not_called()
+        assert mock_notify.call_args.args[0] == "jimoty"
+
+
+class TestSearchUidsSince:
+    def test_default_is_plain_since(self):
+        from src.main import search_uids_since
+        mail = MagicMock()
+        search_uids_since(mail, "01-Jan-2026")
+        mail.uid.assert_called_once_with("search", None, "SINCE", "01-Jan-2026")
+
+    def test_gm_raw_query_is_sent_as_utf8_literal(self):
+        from src.main import search_uids_since
+        mail = MagicMock()
+        with patch("src.main.IMAP_SEARCH_GM_RAW", "subject:(応募 OR ジモティー)"):
+            search_uids_since(mail, "01-Jan-2026")
+        mail.uid.assert_called_once_with("search", "CHARSET", "UTF-8", "SINCE", "01-Jan-2026", "X-GM-RAW")
+        assert mail.literal == "subject:(応募 OR ジモティー)".encode("utf-8")
+
+
+class TestFetchGmMsgidsBatch:
+    def test_maps_uid_to_gm_id(self):
+        from src.main import fetch_gm_msgids_batch
+        mail = MagicMock()
+        mail.uid.return_value = ("OK", [
+            b"1 (X-GM-MSGID 111 UID 10)",
+            b"2 (UID 11 X-GM-MSGID 222)",
+        ])
+        result = fetch_gm_msgids_batch(mail, [b"10", b"11"])
+        assert result == {"10": "gm:111", "11": "gm:222"}
+        mail.uid.assert_called_once_with("fetch", "10,11", "(X-GM-MSGID)")
+
+    def test_chunks_large_uid_sets(self):
+        from src.main import fetch_gm_msgids_batch
+        mail = MagicMock()
+        mail.uid.return_value = ("OK", [])
+        with patch("src.main.IMAP_FETCH_CHUNK_SIZE", 2):
+            fetch_gm_msgids_batch(mail, [b"1", b"2", b"3"])
+        assert [c.args[1] for c in mail.uid.call_args_list] == ["1,2", "3"]
+
+    def test_failed_fetch_returns_empty(self):
+        from src.main import fetch_gm_msgids_batch
+        mail = MagicMock()
+        mail.uid.return_value = ("NO", [None])
+        with patch("src.main.log"):
+            assert fetch_gm_msgids_batch(mail, [b"1"]) == {}
+
+
+class TestFetchBodiesBatch:
+    def test_parses_interleaved_literals(self):
+        from src.main import fetch_bodies_batch
+        mail = MagicMock()
+        mail.uid.return_value = ("OK", [
+            (b"1 (X-GM-MSGID 111 UID 10 BODY[] {5}", b"body1"),
+            b")",
+            (b"2 (X-GM-MSGID 222 UID 11 BODY[] {5}", b"body2"),
+            b")",
+        ])
+        result = fetch_bodies_batch(mail, [b"10", b"11"])
+        assert result == {"10": ("111", b"body1"), "11": ("222", b"body2")}
+        mail.uid.assert_called_once_with("fetch", "10,11", "(X-GM-MSGID BODY.PEEK[])")
+
+    def test_uid_after_literal(self):
+        """UID がリテラルの後ろ（閉じ括弧側）に来る応答形式にも対応すること。"""
+        from src.main import fetch_bodies_batch
+        mail = MagicMock()
+        mail.uid.return_value = ("OK", [
+            (b"1 (X-GM-MSGID 111 BODY[] {5}", b"body1"),
+            b" UID 10)",
+        ])
+        assert fetch_bodies_batch(mail, [b"10"]) == {"10": ("111", b"body1")}
+
+    def test_failed_fetch_returns_empty(self):
+        from src.main import fetch_bodies_batch
+        mail = MagicMock()
+        mail.uid.return_value = ("NO", [None])
+        with patch("src.main.log"):
+            assert fetch_bodies_batch(mail, [b"10"]) == {}
+
+
+class TestHttpSession:
+    def test_https_adapter_is_pooled(self):
+        from src.main import _http_session, _http_adapter
+        assert _http_session.get_adapter("https://hooks.slack.com/services/x") is _http_adapter
+        assert _http_adapter._pool_maxsize == 8
+
+    @patch('src.main.time.sleep')
+    @patch('src.main._http_session.post')
+    @patch('src.main.get_slack_webhook_url', return_value="https://hooks.slack.com/test")
+    def test_slack_notify_sets_connect_and_read_timeouts(self, mock_get_url, mock_post, mock_sleep):
+        from src.main import HTTP_CONNECT_TIMEOUT_SECONDS
+        mock_post.return_value = MagicMock(status_code=200)
+        assert notify_slack_with_retry("jimoty", "山田", "") is True
+        assert mock_post.call_args[1]["timeout"] == (HTTP_CONNECT_TIMEOUT_SECONDS, 10)
+
+
+class TestGracefulShutdown:
+    def teardown_method(self):
+        import src.main
+        src.main._in_cycle = False
+        src.main._shutdown_requested = False
+
+    def test_sigterm_while_idle_exits_immediately(self):
+        import signal
+        from src.main import _handle_sigterm
+        with patch("src.main.log"), pytest.raises(SystemExit):
+            _handle_sigterm(signal.SIGTERM, None)
+
+    def test_sigterm_during_cycle_finishes_cycle_first(self):
+        import signal
+        import src.main
+        from src.main import _poll_forever
+
+        def cycle(ids):
+            # サイクルの途中で SIGTERM を受けても例外にはならず、サイクル後にループを抜ける
+            src.main._handle_sigterm(signal.SIGTERM, None)
+            return True
+
+        with patch("src.main.check_mail_with_status", side_effect=cycle) as mock_cycle, \
+             patch("src.main.wait_for_new_mail") as mock_wait, \
+             patch("src.main.log"):
+            _poll_forever(set())
+        mock_cycle.assert_called_once()
+        mock_wait.assert_not_called()
+
+
+class TestPollForeverIdle:
+    """clean に完走したサイクルの後だけ IMAP IDLE で待つこと"""
+
+    def teardown_method(self):
+        import src.main
+        src.main._shutdown_requested = False
+        src.main._last_cycle_clean = False
+
+    def _run_one_cycle(self, clean):
+        import src.main
+        from src.main import _poll_forever
+
+        def stop(*args):
+            src.main._shutdown_requested = True
+            return True
+
+        with patch("src.main.has_imap_credentials", return_value=True), \
+             patch("src.main._check_mail_attempt", return_value=clean), \
+             patch("src.main.wait_for_new_mail", side_effect=stop) as mock_wait, \
+             patch("src.main.time.sleep", side_effect=stop) as mock_sleep, \
+             patch("src.main.log"):
+            _poll_forever(set())
+        return mock_wait, mock_sleep
+
+    def test_clean_cycle_waits_with_idle(self):
+        mock_wait, mock_sleep = self._run_one_cycle(clean=True)
+        mock_wait.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    def test_deferred_or_failed_mail_skips_idle(self):
+        """繰り越し・通知失敗が残るサイクルの後は IDLE せず POLL_INTERVAL_SECONDS で拾い直すこと"""
+        from src.main import POLL_INTERVAL_SECONDS
+        mock_wait, mock_sleep = self._run_one_cycle(clean=False)
+        mock_wait.assert_not_called()
+        mock_sleep.assert_called_once()
+        assert 0 < mock_sleep.call_args.args[0] <= POLL_INTERVAL_SECONDS
+
+
+class TestMainLoopBackoff:
+    def test_exponential_with_jitter_and_cap(self):
+        from src.main import main_loop_backoff
+        with patch("src.main.POLL_INTERVAL_SECONDS", 15), patch("src.main.MAX_BACKOFF_SECONDS", 900):
+            for _ in range(20):
+                assert 24 <= main_loop_backoff(1) <= 36
+                assert 720 <= main_loop_backoff(10) <= 900
+        # ジッタで上振れしても上限は超えない
+        with patch("src.main.MAX_BACKOFF_SECONDS", 900), patch("src.main.random.uniform", return_value=1.2):
+            assert main_loop_backoff(10) == 900